@@ -0,0 +1,183 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from time import perf_counter
+
+root = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(root, "data_generate"))
+sys.path.insert(0, os.path.join(root, "data_render"))
+
+import numpy as np
+from polycube_generator import cubes
+from angle_registry import list_all_angles
+import software_render
+
+def load_script(path):
+    """Import one of the hyphenated scripts as a module"""
+    name = os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(root, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def timed(function, *args, repeat=1):
+    """Best wall time of repeat calls, in seconds, and the result of the last call"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function(*args)
+        best = min(best, perf_counter() - start)
+    return best, result
+
+def quiet(function, *args):
+    """Call a function with its progress output discarded"""
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        return function(*args)
+
+def baseline_paired_row(args):
+    """One paired_cubes.csv row for singles i and j, built the way data-generate.py did before the block writer,
+    with ids numbered for a single angle grid. Kept so the paired_row result stays comparable with earlier baselines"""
+    i, j, registry, angles, label_ids = args
+    num_shapes = len(registry)
+    shape_i, angle_i = i % num_shapes, i // num_shapes
+    shape_j, angle_j = j % num_shapes, j // num_shapes
+
+    row = [i * num_shapes * len(angles) + j, bool(label_ids[shape_i] == label_ids[shape_j])]
+    row.extend(registry.csv_cells[shape_i])
+    row.extend(angles[angle_i])
+    row.extend(registry.csv_cells[shape_j])
+    row.extend(angles[angle_j])
+    return row
+
+def bench_enumeration(results, max_n, repeat):
+    """generate_polycubes for every n, and rle / cube_exists_rle (misses and rotated hits) / canonical_key per call on the polycubes of the largest n"""
+    polycubes = []
+    for n in range(1, max_n + 1):
+        seconds, polycubes = timed(lambda: quiet(cubes.generate_polycubes, n), repeat=repeat)
+        results[f"generate_polycubes_n{n}"] = {"value": seconds, "unit": "s", "higher_is_better": False, "count": len(polycubes)}
+
+    seconds, _ = timed(lambda: [cubes.rle(polycube) for polycube in polycubes], repeat=repeat)
+    results["rle_per_call"] = {"value": seconds / len(polycubes), "unit": "s", "higher_is_better": False}
+
+    # Enumeration queries new polycubes, which check all 24 rotations, and duplicates in any orientation.
+    # Misses are timed against an empty set, hits with a randomly rotated copy of every polycube
+    known = {cubes.rle(polycube) for polycube in polycubes}
+    rng = np.random.default_rng(0)
+    rotated = [list(cubes.all_rotations(polycube))[rotation] for polycube, rotation in zip(polycubes, rng.integers(0, 24, len(polycubes)))]
+    seconds, _ = timed(lambda: [cubes.cube_exists_rle(polycube, set()) for polycube in polycubes], repeat=repeat)
+    results["cube_exists_rle_per_call"] = {"value": seconds / len(polycubes), "unit": "s", "higher_is_better": False}
+    seconds, _ = timed(lambda: [cubes.cube_exists_rle(polycube, known) for polycube in rotated], repeat=repeat)
+    results["cube_exists_rle_rotated_per_call"] = {"value": seconds / len(polycubes), "unit": "s", "higher_is_better": False}
+    seconds, _ = timed(lambda: [cubes.canonical_key(polycube) for polycube in polycubes], repeat=repeat)
+    results["canonical_key_per_call"] = {"value": seconds / len(polycubes), "unit": "s", "higher_is_better": False}
+
+def bench_pairs(results, data_generate, num_cubes, angle_round, workers, repeat):
+    """list_all_angles and the angles x polycubes cross join, then baseline_paired_row and write_paired_cubes rows per second"""
+    seconds, angles = timed(lambda: list(list_all_angles(angle_round)), repeat=repeat)
+    results["list_all_angles"] = {"value": seconds, "unit": "s", "higher_is_better": False, "count": len(angles)}
+    registry = quiet(data_generate.generate_all_polycubes, num_cubes)
+    seconds, singles = timed(lambda: [(cells, angle) for angle in angles for cells in registry.csv_cells], repeat=repeat)
+    results["cross_join"] = {"value": seconds, "unit": "s", "higher_is_better": False, "count": len(singles)}
+
+    num_singles = len(singles)
+    label_ids = registry.label_ids()
+    rows = min(num_singles ** 2, 200000)
+    seconds, _ = timed(lambda: [baseline_paired_row((k // num_singles, k % num_singles, registry, angles, label_ids))
+                                for k in range(rows)], repeat=repeat)
+    results["paired_row"] = {"value": rows / seconds, "unit": "rows/s", "higher_is_better": True}
+
+    # write_paired_cubes appends to paired_cubes.csv in the working directory, so run it in a temporary one
+    def write_pairs():
+        if os.path.exists("paired_cubes.csv"):
+            os.remove("paired_cubes.csv")
+        quiet(data_generate.write_paired_cubes, registry, angles, 0, None, workers)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            seconds, _ = timed(write_pairs, repeat=repeat)
+        finally:
+            os.chdir(cwd)
+    results["write_paired_cubes"] = {"value": num_singles ** 2 / seconds, "unit": "rows/s", "higher_is_better": True, "count": num_singles ** 2}
+
+def bench_render(results, data_generate, angle_round, size, repeat):
+    """Images per second of the software renderer, rendering every angle of a 5-block shape in one batch"""
+    angles = list(list_all_angles(angle_round))
+    blocks = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (1, 1, 1), (2, 1, 1)]
+    seconds, _ = timed(software_render.render_views, blocks, angles, size, repeat=repeat)
+    results["render_software"] = {"value": len(angles) / seconds, "unit": "images/s", "higher_is_better": True, "count": len(angles)}
+
+def compare(results, baseline, tolerance):
+    """Print every result next to its baseline and return the names of the ones that got worse by more than tolerance"""
+    regressions = []
+    print(f"{'benchmark':32} {'value':>14} {'baseline':>14} {'change':>8}")
+    for name, result in results.items():
+        value = result["value"]
+        base = baseline.get(name, {}).get("value")
+        if base is None:
+            print(f"{name:32} {value:14.6g} {'-':>14} {'-':>8}")
+            continue
+        # Positive change is always an improvement, whichever direction is better for the metric
+        change = (value - base) / base if result["higher_is_better"] else (base - value) / base
+        flag = " REGRESSION" if change < -tolerance else ""
+        print(f"{name:32} {value:14.6g} {base:14.6g} {change:+8.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time polycube enumeration, pair generation and rendering, and compare against a baseline.")
+    parser.add_argument('-o', '--output', type=str, default="benchmark.json", help='Where to write the results as JSON')
+    parser.add_argument('-b', '--baseline', type=str, default="benchmark_baseline.json", help='Baseline results to compare against, when the file exists')
+    parser.add_argument('--save-baseline', action='store_true', help='Also save these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Fraction a result may get worse than the baseline before it counts as a regression')
+    parser.add_argument('--max-n', type=int, default=8, help='Largest polycube size to enumerate')
+    parser.add_argument('--pair-cubes', type=int, default=4, help='Maximum cubes per shape for the pair benchmarks')
+    parser.add_argument('--pair-angle-round', type=int, default=40, help='Angle rounding for the pair benchmarks')
+    parser.add_argument('--render-angle-round', type=int, default=20, help='Angle rounding for the render benchmark')
+    parser.add_argument('--size', type=int, nargs=2, default=[128, 128], help='Width and height of rendered images')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of processes writing paired cubes (default: all cores)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs of each benchmark. The best one is kept')
+    args = parser.parse_args()
+
+    data_generate = load_script(os.path.join("data_generate", "data-generate.py"))
+    results = {}
+    print("Benchmarking enumeration...")
+    bench_enumeration(results, args.max_n, args.repeat)
+    print("Benchmarking pair generation...")
+    bench_pairs(results, data_generate, args.pair_cubes, args.pair_angle_round, args.workers, args.repeat)
+    print("Benchmarking rendering...")
+    bench_render(results, data_generate, args.render_angle_round, tuple(args.size), args.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "save_baseline", "tolerance")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            print("Baseline was run with different settings, results may not be comparable")
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    if regressions:
+        print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+        sys.exit(1)
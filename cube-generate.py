@@ -1,40 +1,33 @@
+import argparse
+import os
+import sys
+
+# Batch rendering (--csv) runs headless through EGL, which has to be selected before OpenGL is imported.
+# A minimal pre-parse sees --csv written any way the full parser accepts it: --csv=path, or an abbreviation like --cs
+batch_parser = argparse.ArgumentParser(add_help=False)
+batch_parser.add_argument('--csv', type=str)
+if batch_parser.parse_known_args()[0].csv:
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+    os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
 import pygame
 from pygame.locals import *
 from OpenGL.GL import *
 from OpenGL.GLU import *
-import argparse
+import ast
+import csv
+import ctypes
+import numpy as np
+from collections import deque
+from multiprocessing import Pool
 
-# Define a cube (8 vertices)
-vertices = [
-    [1, 1, -1],
-    [1, -1, -1],
-    [-1, -1, -1],
-    [-1, 1, -1],
-    [1, 1, 1],
-    [1, -1, 1],
-    [-1, -1, 1],
-    [-1, 1, 1]
-]
-
-edges = [
-    (0,1), (1,2), (2,3), (3,0),
-    (4,5), (5,6), (6,7), (7,4),
-    (0,4), (1,5), (2,6), (3,7)
-]
-
-def draw_cube(position=(0,0,0)):
-    """Draw a cube translated to the given position"""
-    glPushMatrix()
-    glTranslatef(*position)
-    glBegin(GL_LINES)
-    for edge in edges:
-        for vertex in edge:
-            glVertex3fv(vertices[vertex])
-    glEnd()
-    glPopMatrix()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_render"))
+import gl_shape
+import shape_geometry
+import software_render
 
-def render_shape(cubes, angle=(30,30)):
-    """Render a shape made from cubes at a given angle, with mouse control"""
+def render_shape(cubes, angle=(30,30), on_frame=None):
+    """Render a shape made from cubes at a given angle, with mouse control. on_frame(rot_x, rot_y) is called after every frame"""
     pygame.init()
     display = (800,600)
     pygame.display.set_mode(display, DOUBLEBUF|OPENGL)
@@ -45,6 +38,9 @@ def render_shape(cubes, angle=(30,30)):
     clock = pygame.time.Clock()
     running = True
 
+    # Compiled once, then drawn with a single call every frame
+    shape = gl_shape.get_shape(tuple(map(tuple, np.asarray(cubes).tolist())), cubes)
+
     rot_x, rot_y = angle
     dragging = False
     last_mouse_pos = None
@@ -76,15 +72,173 @@ def render_shape(cubes, angle=(30,30)):
         glRotatef(rot_y, 0, 1, 0)
 
         # Draw all cubes in the shape
-        for cube_pos in cubes:
-            draw_cube(cube_pos)
+        gl_shape.draw_shape_edges(shape)
 
         glPopMatrix()
         pygame.display.flip()
+        if on_frame is not None:
+            on_frame(rot_x, rot_y)
         clock.tick(30)
 
     pygame.quit()
 
+def create_offscreen_context(size):
+    """Create a headless OpenGL context through EGL, rendering into a framebuffer object of the given size"""
+    from OpenGL import EGL
+
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError("Could not initialise an EGL display for headless rendering")
+
+    attributes = (EGL.EGLint * 5)(EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT, EGL.EGL_SURFACE_TYPE, 0, EGL.EGL_NONE)
+    config, num_configs = EGL.EGLConfig(), EGL.EGLint()
+    EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(num_configs))
+    if num_configs.value == 0:
+        raise RuntimeError("No EGL config supports desktop OpenGL")
+
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, context)
+
+    # No window, so render into a framebuffer object with colour and depth attachments
+    framebuffer = glGenFramebuffers(1)
+    glBindFramebuffer(GL_FRAMEBUFFER, framebuffer)
+    colour, depth = glGenRenderbuffers(2)
+    glBindRenderbuffer(GL_RENDERBUFFER, colour)
+    glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, *size)
+    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, colour)
+    glBindRenderbuffer(GL_RENDERBUFFER, depth)
+    glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, *size)
+    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth)
+    if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+        raise RuntimeError("Could not create an offscreen framebuffer")
+
+    # Same camera as render_shape, with one fixed light for the faces
+    glViewport(0, 0, *size)
+    glMatrixMode(GL_PROJECTION)
+    gluPerspective(45, (size[0]/size[1]), 0.1, 50.0)
+    glMatrixMode(GL_MODELVIEW)
+    glTranslatef(0.0,0.0, -20)
+
+    glEnable(GL_DEPTH_TEST)
+    glEnable(GL_LIGHT0)
+    glLightfv(GL_LIGHT0, GL_POSITION, (5, 10, 20, 0))
+    glLightfv(GL_LIGHT0, GL_DIFFUSE, (0.5, 0.5, 0.5, 1))
+    glLightModelfv(GL_LIGHT_MODEL_AMBIENT, (0.15, 0.15, 0.15, 1))
+    glEnable(GL_COLOR_MATERIAL)
+    glEnable(GL_POLYGON_OFFSET_FILL)
+    glPolygonOffset(1, 1)
+    glClearColor(0, 0, 0, 1)
+
+def render_offscreen(shape, angle, size):
+    """Render a shape compiled with gl_shape into the current offscreen context and return it as a (height, width, 3) uint8 image"""
+    glClear(GL_COLOR_BUFFER_BIT|GL_DEPTH_BUFFER_BIT)
+    glPushMatrix()
+    glRotatef(angle[0], 1, 0, 0)
+    glRotatef(angle[1], 0, 1, 0)
+
+    # Faces darker than edges, shaded by the fixed light
+    glEnable(GL_LIGHTING)
+    glColor3f(0.6, 0.6, 0.6)
+    gl_shape.draw_shape_faces(shape)
+
+    # Highlighted edges, hidden where the faces in front cover them
+    glDisable(GL_LIGHTING)
+    glColor3f(1, 1, 1)
+    gl_shape.draw_shape_edges(shape)
+
+    glPopMatrix()
+    pixels = glReadPixels(0, 0, size[0], size[1], GL_RGB, GL_UNSIGNED_BYTE)
+    return np.frombuffer(pixels, dtype=np.uint8).reshape(size[1], size[0], 3)[::-1]
+
+def save_image(job):
+    """Encode and save one rendered image. Runs in the encoding worker pool"""
+    image, path = job
+    pygame.image.save(pygame.image.frombuffer(image.tobytes(), (image.shape[1], image.shape[0]), "RGB"), path)
+
+def parse_blocks(cells):
+    """Parse block position cells such as "(0, 1, 0)", skipping the "()" padding"""
+    return [ast.literal_eval(cell) for cell in cells if cell.strip() not in ("", "()")]
+
+def read_render_jobs(csv_path):
+    """
+    Read (blocks, angle, file name) render jobs from single_cubes.csv, paired_cubes.csv,
+    or a binary pair table (with shapes.npy and angles.npy next to it)
+    """
+    if csv_path.endswith(".npy"):
+        directory = os.path.dirname(csv_path)
+        shapes = np.load(os.path.join(directory, "shapes.npy"))
+        angles = np.load(os.path.join(directory, "angles.npy")).tolist()
+        blocks = [shape["blocks"][:shape["num_blocks"]].tolist() for shape in shapes]
+        for pair in np.load(csv_path, mmap_mode="r"):
+            yield blocks[pair["shape_a"]], angles[pair["angle_a"]], f"pair_{pair['id']}_1.png"
+            yield blocks[pair["shape_b"]], angles[pair["angle_b"]], f"pair_{pair['id']}_2.png"
+        return
+
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        if "SAME" in header:
+            first = [i for i, name in enumerate(header) if name.startswith("im_1_block_")]
+            second = [i for i, name in enumerate(header) if name.startswith("im_2_block_")]
+            angle_first = header.index("im_1_angle_x"), header.index("im_1_angle_y")
+            angle_second = header.index("im_2_angle_x"), header.index("im_2_angle_y")
+            for row in reader:
+                yield parse_blocks(row[i] for i in first), [float(row[i]) for i in angle_first], f"pair_{row[0]}_1.png"
+                yield parse_blocks(row[i] for i in second), [float(row[i]) for i in angle_second], f"pair_{row[0]}_2.png"
+        else:
+            columns = [i for i, name in enumerate(header) if name.startswith("block_")]
+            angle = header.index("angle_x"), header.index("angle_y")
+            for index, row in enumerate(reader):
+                yield parse_blocks(row[i] for i in columns), [float(row[i]) for i in angle], f"single_{index:06d}.png"
+
+def render_batch(csv_path, output_dir, size=(128, 128), workers=None, backend="gl", batch_size=4096):
+    """
+    Render every row of a single or pair table to image files, without a display.
+    The gl backend reuses one offscreen context and the compiled buffers of each shape. The numpy backend buffers batch_size jobs
+    and renders all the angles wanted of each shape in the batch at once with software_render.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if backend == "gl":
+        create_offscreen_context(size)
+    workers = workers or os.cpu_count()
+
+    with Pool(workers) as pool:
+        pending = deque()
+
+        def save(image, name):
+            pending.append(pool.apply_async(save_image, ((image, os.path.join(output_dir, name)),)))
+            if len(pending) >= 4 * workers:
+                pending.popleft().get()
+
+        def render_group(jobs):
+            by_shape = {}
+            for blocks, angle, name in jobs:
+                by_shape.setdefault(tuple(map(tuple, blocks)), []).append((angle, name))
+            for blocks, views in by_shape.items():
+                images = software_render.render_views(blocks, [angle for angle, _ in views], size)
+                for image, (_, name) in zip(images, views):
+                    save(np.repeat(image[..., None], 3, axis=2), name)
+
+        batch = []
+        for count, (blocks, angle, name) in enumerate(read_render_jobs(csv_path), 1):
+            if backend == "gl":
+                key = tuple(map(tuple, blocks))
+                shape = gl_shape.compiled_shapes.get(key) or gl_shape.get_shape(key, shape_geometry.cube_centres(blocks))
+                save(render_offscreen(shape, angle, size), name)
+            else:
+                batch.append((blocks, angle, name))
+                if len(batch) >= batch_size:
+                    render_group(batch)
+                    batch = []
+            if count % 1000 == 0:
+                print(f"\rRendered {count} images", end="")
+        render_group(batch)
+        while pending:
+            pending.popleft().get()
+    print("\rRendering done.       ")
+
 # Example: build a shape (like a "stair step" of cubes)
 # anglex = 40
 # render_shape(cube_positions, angle=(anglex,45))
@@ -95,5 +249,17 @@ if __name__ == "__main__":
     parser.add_argument('--positions', type=str, help='List of cubes and their positions. Formatted as "[(x1,y1,z1), (x2,y2,z2), ...]". A maximum of 5 cubes is permitted.')
     parser.add_argument('--csv', type=str, help='Path to a CSV file containing cube positions and orientations. This will generate pairs of images and can perform batch processing. Can be used instead of --angle and --positions.')
     
+    parser.add_argument('--output', type=str, default="images", help='Directory to write batch-rendered images to')
+    parser.add_argument('--size', type=int, nargs=2, default=[128, 128], help='Width and height of batch-rendered images')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes encoding batch-rendered images')
+    parser.add_argument('--backend', type=str, choices=["gl", "numpy"], default="gl", help='Batch renderer: headless OpenGL, or the NumPy software rasterizer that renders every angle of a shape in one pass')
+    
     args = parser.parse_args()
-    args.angle
\ No newline at end of file
+
+    if args.csv:
+        render_batch(args.csv, args.output, tuple(args.size), args.workers, args.backend)
+    else:
+        if args.positions is None:
+            parser.error("--positions is required unless --csv is given")
+        angle = args.angle or (30, 30, 0)
+        render_shape(shape_geometry.cube_centres(ast.literal_eval(args.positions)), angle=(angle[0], angle[1]))
@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+import numpy as np
+
+# List all angles that exist within our desired angle-rounding
+def list_all_angles(angle_round):
+    for x in range(0, 360, angle_round):
+        for y in range(0, 360, angle_round):
+            yield (x, y)
+
+# Every viewing angle with a stable integer angle id, saved between runs so the angle grid can be refined.
+# Ids are given in order of first appearance and never change: refining only appends the angles that are new,
+# so every single image, pair id and render of the earlier angles stays valid (see pair_table.decode_pair_ids).
+# Each refinement is recorded as a version, with the angle rounding it added and the number of angles after it.
+# Indexing, iterating and len() behave like the plain list of angles it replaces.
+class AngleRegistry:
+    def __init__(self, angles=(), versions=()):
+        self.angles = [tuple(int(v) for v in angle) for angle in angles]
+        self.versions = [dict(version) for version in versions]
+        self.ids = {angle: angle_id for angle_id, angle in enumerate(self.angles)}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["angles"], data["versions"])
+
+    # Save under a unique temporary name and move it into place, so a crash never leaves a partial registry
+    # and shards saving into the same directory at once never write over each other's temporary file
+    def save(self, path):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".angle_registry.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"versions": self.versions, "angles": self.angles}, f)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def __len__(self):
+        return len(self.angles)
+
+    def __getitem__(self, angle_id):
+        return self.angles[angle_id]
+
+    def __iter__(self):
+        return iter(self.angles)
+
+    # Add the angles of list_all_angles(angle_round) that are not registered yet, as a new version.
+    # Returns the number of angles added, 0 when the grid adds nothing (and no version is recorded)
+    def refine(self, angle_round):
+        new_angles = [angle for angle in list_all_angles(angle_round) if angle not in self.ids]
+        for angle in new_angles:
+            self.ids[angle] = len(self.angles)
+            self.angles.append(angle)
+        if new_angles:
+            self.versions.append({"version": len(self.versions) + 1, "angle_round": angle_round, "num_angles": len(self.angles)})
+        return len(new_angles)
+
+    # Number of angles after each version. Pair ids are numbered version by version (see pair_table.decode_pair_ids)
+    def angle_counts(self):
+        return [version["num_angles"] for version in self.versions]
+
+    # Angle ids in list_all_angles order for the finest rounding registered, with the number of steps per axis,
+    # for code that steps across the angle grid. Raises ValueError when the registered angles are not that whole grid
+    def grid(self):
+        angle_round = min(version["angle_round"] for version in self.versions)
+        steps = 360 // angle_round
+        ids = [self.ids.get(angle) for angle in list_all_angles(angle_round)]
+        if len(self) != steps * steps or None in ids:
+            raise ValueError(f"The registered angles are not a {angle_round} degree grid, refine with a rounding that divides the earlier ones")
+        return steps, np.array(ids, dtype=np.int64)
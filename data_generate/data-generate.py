@@ -1,153 +1,68 @@
 import argparse
 import csv
-from polycube_generator import cubes
+import os
+from polycube_generator import cubes, metrics
+import pair_table
+import pair_sampler
+import pair_shards
+from shape_registry import ShapeRegistry
+from angle_registry import AngleRegistry
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
-from queue import Queue
-import threading
 
-# List all angles that exist within our desired angle-rounding
-def list_all_angles(angle_round):
-    for x in range(0, 360, angle_round):
-        for y in range(0, 360, angle_round):
-            yield (x, y)
-            
-# Generate all polycubes that can be made from 1 to n cubes
-def generate_all_polycubes(num_cubes):
+# Generate all polycubes that can be made from 1 to n cubes, as a registry that gives each one a dense shape id
+# Each size is generated once from the previous size, or loaded from cache_dir when present
+def generate_all_polycubes(num_cubes, cache_dir=None):
     polycube_coords_list = []
-    for i in range(1, num_cubes + 1):
-        polycube_i_list = cubes.generate_polycubes(i)
-        for i, cube in enumerate(polycube_i_list):
-            coords = list(zip(*np.nonzero(cube)))
-            polycube_coords_list.append(coords)
-    
-    # Convert back to standard int
-    for i in range(0, len(polycube_coords_list)):
-        for j in range(0, len(polycube_coords_list[i])):
-            for k in range(0, len(polycube_coords_list[i][j])):
-                polycube_coords_list[i][j] = tuple(int(i) for i in polycube_coords_list[i][j])
-            
-    return polycube_coords_list
+    for _, coords in cubes.iter_polycubes(num_cubes, cache_dir=cache_dir, coords=True):
+        polycube_coords_list.append(coords)
+
+    return ShapeRegistry(polycube_coords_list, num_cubes)
 
-def write_single_cubes(angles_polycubes):
+# Write every (shape, angle) single image to single_cubes.csv, angle-major like the pair ids expect
+# From angle_start onwards, the rows are appended to the rows of the earlier angles already in the file
+def write_single_cubes(registry, angles, angle_start=0):
     print("Export single-cube list")
-    with open("single_cubes.csv", "w") as f:
+    with open("single_cubes.csv", "a" if angle_start else "w") as f:
         writer = csv.writer(f)
         header = ["num_blocks"]
-        [header.append(f"block_{i}_pos") for i in range(1,num_cubes+1)]
+        [header.append(f"block_{i}_pos") for i in range(1,registry.num_cubes+1)]
         header.append("angle_x")
         header.append("angle_y")
         
-        writer.writerow(header)
+        if not angle_start:
+            writer.writerow(header)
         
-        for i in angles_polycubes:
-            row = []
-            num_cubes_i = len(i[0])
-            block_positions = []
-            for cube in range(0, num_cubes):
-                try:
-                    block_positions.append(i[0][cube])
-                except IndexError:
-                    block_positions.append("()")
-            angle_x = i[1][0]
-            angle_y = i[1][1]
-            
-            row.append(num_cubes_i)
-            row.extend(block_positions)
-            row.append(angle_x)
-            row.append(angle_y)
-            
-            writer.writerow(row)
-            
-def paired_row(args):
-    i, j, angles_polycubes, num_cubes = args
-    row = []
-    id = i * len(angles_polycubes) + j
-    num_cubes_i = len(angles_polycubes[i][0])
-    block_positions_i = []
-    for cube in range(0, num_cubes):
-        if cube < len(angles_polycubes[i][0]):
-            block_positions_i.append(angles_polycubes[i][0][cube])
-        else:
-            block_positions_i.append("()")
-    angle_x_i = angles_polycubes[i][1][0]
-    angle_y_i = angles_polycubes[i][1][1]
-    
-    num_cubes_j = len(angles_polycubes[j][0])
-    block_positions_j = []
-    for cube in range(0, num_cubes):
-        if cube < len(angles_polycubes[j][0]):
-            block_positions_j.append(angles_polycubes[j][0][cube])
-        else:
-            block_positions_j.append("()")
-    angle_x_j = angles_polycubes[j][1][0]
-    angle_y_j = angles_polycubes[j][1][1]
-    
-    same = block_positions_i == block_positions_j
-    
-    row.append(id)
-    row.append(same)
-    row.append(num_cubes_i)
-    row.extend(block_positions_i)
-    row.append(angle_x_i)
-    row.append(angle_y_i)
-    row.append(num_cubes_j)
-    row.extend(block_positions_j)
-    row.append(angle_x_j)
-    row.append(angle_y_j)
-    return row
-
-def write_paired_cubes(angles_polycubes):
-    print("Export paired-cube list")
-    header = ["id", "SAME", "im_1_num_blocks"]
-    [header.append(f"im_1_block_{i}_pos") for i in range(1,num_cubes+1)]
-    header.append("im_1_angle_x")
-    header.append("im_1_angle_y")
-    header.append("im_2_num_blocks")
-    [header.append(f"im_2_block_{i}_pos") for i in range(1,num_cubes+1)]
-    header.append("im_2_angle_x")
-    header.append("im_2_angle_y")
+        for angle_x, angle_y in angles[angle_start:]:
+            for cells in registry.csv_cells:
+                writer.writerow(cells + [angle_x, angle_y])
 
-    task_queue = Queue(maxsize=1000)  # limit queue size to avoid memory issues
-    write_lock = threading.Lock()
+# Number of single images in single_cubes.csv, or None when there is no such file
+def count_single_cubes():
+    if not os.path.exists("single_cubes.csv"):
+        return None
+    with open("single_cubes.csv") as f:
+        return sum(1 for _ in f) - 1
 
-    def worker():
-        while True:
-            args = task_queue.get()
-            if args is None:
-                break
-            row = paired_row(args)
-            with write_lock:
-                writer.writerow(row)
-            task_queue.task_done()
+# Write every pair from pair_id_start onwards to paired_cubes.csv, formatted in blocks by a process pool
+def write_paired_cubes(registry, angles, pair_id_start=0, label_ids=None, workers=None, angle_counts=None):
+    print("Export paired-cube list")
+    fragments = pair_table.single_csv_fragments(registry.csv_cells, angles)
+    label_ids = registry.label_ids() if label_ids is None else label_ids
+    single_counts = pair_table.single_counts(len(registry), len(angles), angle_counts)
+    num_pairs = len(fragments) ** 2
+    workers = workers or os.cpu_count()
+    if pair_id_start >= num_pairs:
+        print(f"All {num_pairs} pairs are already written")
+        return
+    i, j = pair_table.decode_pair_ids([pair_id_start], single_counts)
+    print(f"Starting at {pair_id_start}, i={i[0]}, j={j[0]}. angles_polycubes={len(fragments)}")
 
     with open("paired_cubes.csv", "a", newline='') as f:
-        writer = csv.writer(f)
         if pair_id_start == 0:
-            writer.writerow(header)
-
-        num_workers = min(8, threading.active_count() + 4)  # adjust as needed
-        threads = []
-        for _ in range(num_workers):
-            t = threading.Thread(target=worker)
-            t.start()
-            threads.append(t)
-            
-        i_start = int(pair_id_start / len(angles_polycubes))
-        j_start = pair_id_start - (len(angles_polycubes) * i_start)
-        print(f"Starting at {pair_id_start}, i={i_start}, j={j_start}. angles_polycubes={len(angles_polycubes)}")
-
-        for i in range(i_start, len(angles_polycubes)):
-            for j in range(j_start, len(angles_polycubes)):
-                task_queue.put((i, j, angles_polycubes, num_cubes))
+            csv.writer(f).writerow(pair_table.csv_header(registry.num_cubes))
 
-        # Signal workers to exit
-        for _ in threads:
-            task_queue.put(None)
-
-        task_queue.join()
-        for t in threads:
-            t.join()
+        with pair_table.csv_pool(fragments, label_ids, workers, single_counts) as pool:
+            pair_table.write_csv_rows(f, pool, workers, pair_id_start, num_pairs)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate cubes with specified parameters.")
@@ -155,24 +70,102 @@ if __name__ == "__main__":
     parser.add_argument('-a', '--angle-round', type=int, default=10, help='Round viewing angles to the nearest a degrees')
     parser.add_argument('-s', '--single-only', type=bool, default=False, help='Only generate single cubes, not paired cubes')
     parser.add_argument('-p', '--pair-id-start', type=int, default=0, help="Sets the starting id for paired cubes")
+    parser.add_argument('-f', '--format', type=str, choices=["csv", "npy"], default="csv", help="Write pairs as paired_cubes.csv, or as a binary pair table (paired_cubes.npy) with shapes.npy and angles.npy")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="Number of processes formatting paired-cube rows (default: all cores)")
+    parser.add_argument('--shard', type=str, default=None, help="Only generate shard k of N (given as k/N) as chunk files in --out-dir, e.g. 3/32")
+    parser.add_argument('--resume', action='store_true', help="Read the shard manifest and only regenerate missing or corrupt chunks")
+    parser.add_argument('--out-dir', type=str, default="paired_cubes", help="Directory for sharded chunk files and manifests")
+    parser.add_argument('--chunk-size', type=int, default=1 << 22, help="Number of pairs per chunk file when sharding")
+    parser.add_argument('--sample-rate', type=float, default=None, help="Only write a random sample of this fraction of all pairs, e.g. 0.0033")
+    parser.add_argument('--same-ratio', type=float, default=0.5, help="Fraction of sampled pairs that are SAME")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for sampling. The same seed always gives the same pairs")
+    parser.add_argument('--stratify', type=str, nargs='*', choices=["blocks", "delta"], default=[], help="Spread sampled pairs evenly across block counts and/or angle deltas")
+    parser.add_argument('--dedupe-views', action='store_true', help="Only sample pairs of distinct images, mapping views that look identical because of a shape's symmetry to one representative angle")
+    parser.add_argument('-c', '--cache-dir', type=str, default=None, help="Directory to load and save generated polycubes of each size")
+    parser.add_argument('--refine', action='store_true', help="Add the angles of --angle-round that are new to the angle registry, and only generate the singles and pairs they add to the earlier outputs")
+    parser.add_argument('--angle-registry', type=str, default="angle_registry.json", help="Angle registry giving every angle a stable id, saved by every run and extended by --refine")
+    parser.add_argument('--metrics', type=str, default=None, help="Append counters, timers and peak memory of every phase to this file as JSON lines")
+    parser.add_argument('--metrics-interval', type=float, default=5.0, help="Seconds between progress lines in the metrics file")
+    parser.add_argument('--profile', type=str, choices=["cprofile", "sample"], default=None, help="Also profile every phase (with --metrics): cprofile saves .prof files next to the metrics file, sample records the hottest lines")
     args = parser.parse_args()
     
     num_cubes = args.num_cubes
     angle_round = args.angle_round
-    pair_id_start = args.pair_id_start + 1
+    pair_id_start = args.pair_id_start
     single_only = args.single_only
     
+    if args.metrics:
+        metrics.configure(args.metrics, args.metrics_interval, args.profile)
+
     print("Generating angles...")
-    angles = list(list_all_angles(angle_round))
+    with metrics.phase("angles", angle_round=angle_round):
+        if args.refine and os.path.exists(args.angle_registry):
+            angle_registry = AngleRegistry.load(args.angle_registry)
+        else:
+            angle_registry = AngleRegistry()
+        previous_angles = len(angle_registry)
+        added = angle_registry.refine(angle_round)
+        angles = list(angle_registry)
+        angle_counts = angle_registry.angle_counts()
+    if args.refine:
+        print(f"Angle registry version {len(angle_counts)}: {previous_angles} angles kept, {added} added")
     print("Generating polycubes...")
-    polycubes = generate_all_polycubes(num_cubes)
-    
-    print("Cross-join on angles and polycubes...")
-    angles_polycubes = [(y,x) for x in angles for y in polycubes]
-    
-    write_single_cubes(angles_polycubes)
-            
-    if not single_only:
-        write_paired_cubes(angles_polycubes)
+    with metrics.phase("polycubes", num_cubes=num_cubes):
+        registry = generate_all_polycubes(num_cubes, args.cache_dir)
+    label_ids = registry.label_ids()
+    num_singles = len(registry) * len(angles)
+
+    # Outputs of the earlier angles are only reused when single_cubes.csv shows they were generated for the same shapes.
+    # It may already hold the singles of the new angles too, when an earlier run of this refinement was interrupted
+    single_start = previous_angles
+    if previous_angles:
+        singles_written = count_single_cubes()
+        if singles_written == num_singles:
+            single_start = len(angles)
+        elif singles_written != len(registry) * previous_angles:
+            print("single_cubes.csv does not match the earlier angles, generating everything")
+            previous_angles = single_start = 0
+            if os.path.exists("paired_cubes.csv"):
+                os.remove("paired_cubes.csv")
+
+    with metrics.phase("single_cubes", singles=num_singles - len(registry) * single_start):
+        write_single_cubes(registry, angles, single_start)
             
-    print("Done.")
\ No newline at end of file
+    with metrics.phase("pairs", format=args.format):
+        if not single_only and args.sample_rate is not None:
+            print("Sampling paired-cube list")
+            num_samples = int(round(args.sample_rate * num_singles ** 2))
+            view_aliases = registry.view_aliases(angles) if args.dedupe_views else None
+            angle_steps, angle_grid = angle_registry.grid() if "delta" in args.stratify else (360 // angle_round, None)
+            pairs = pair_sampler.sample_pairs(registry.num_blocks, len(angles), num_samples, args.same_ratio, args.seed,
+                                              angle_steps, "blocks" in args.stratify, "delta" in args.stratify, label_ids, view_aliases,
+                                              angle_counts, angle_grid)
+            if args.format == "npy":
+                pair_table.write_tables(registry, angles)
+                np.save("paired_cubes.npy", pairs)
+            else:
+                pair_table.pairs_to_csv(pairs, registry.table, pair_table.angle_table(angles), "paired_cubes.csv")
+        elif not single_only and (args.shard is not None or args.resume):
+            k, n = pair_shards.parse_shard(args.shard or "0/1")
+            if args.format == "npy":
+                pair_table.write_tables(registry, angles)
+            pair_shards.write_shard(registry, angles, label_ids, args.out_dir, k, n, args.format, args.chunk_size, args.workers,
+                                    args.resume or args.refine, angle_counts)
+        elif not single_only:
+            if args.format == "npy":
+                print("Export paired-cube table")
+                pair_table.write_tables(registry, angles)
+                if previous_angles and os.path.exists("paired_cubes.npy"):
+                    pair_table.extend_pair_table("paired_cubes.npy", len(registry), len(angles), label_ids, angle_counts=angle_counts)
+                else:
+                    pair_table.write_pair_table("paired_cubes.npy", len(registry), len(angles), pair_id_start, label_ids, angle_counts=angle_counts)
+            elif previous_angles and os.path.exists("paired_cubes.csv"):
+                # Resume after the last pair written, wherever an earlier run stopped
+                write_paired_cubes(registry, angles, pair_table.csv_resume_id("paired_cubes.csv"), label_ids, args.workers, angle_counts)
+            else:
+                write_paired_cubes(registry, angles, pair_id_start, label_ids, args.workers, angle_counts)
+
+    # Saved once the outputs are complete, so an interrupted refinement is generated again by the next --refine
+    angle_registry.save(args.angle_registry)
+    metrics.close()
+    print("Done.")
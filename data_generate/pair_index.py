@@ -0,0 +1,150 @@
+import argparse
+import csv
+import os
+import sys
+import numpy as np
+import pair_table
+from angle_registry import AngleRegistry
+
+# Every pair of single images addressed by pair id, decoded in O(1) from the shape and angle tables alone.
+# Behaves like a read-only table of pair records (pair_table.PAIR_DTYPE) holding every pair: len() is the number of pairs,
+# and an id, a slice or an array of ids gives the same records paired_cubes.npy holds at those positions, without reading it.
+class PairIndex:
+    def __init__(self, shapes, angles, label_ids=None, angle_counts=None):
+        self.shapes = shapes
+        self.angles = np.asarray(angles)
+        self.num_shapes, self.num_angles = len(shapes), len(self.angles)
+        self.label_ids = label_ids
+        self.angle_counts = angle_counts
+        self.num_pairs = (self.num_shapes * self.num_angles) ** 2
+        self.shape_cells = None
+
+    # Load the tables written by data-generate.py --format npy, and the angle registry when there is one,
+    # since refined angle grids number their pair ids version by version (see pair_table.decode_pair_ids)
+    @classmethod
+    def load(cls, shapes_path="shapes.npy", angles_path="angles.npy", registry_path="angle_registry.json"):
+        shapes, angles = np.load(shapes_path), np.load(angles_path)
+        angle_counts = None
+        if registry_path is not None and os.path.exists(registry_path):
+            angle_counts = AngleRegistry.load(registry_path).angle_counts()
+            if angle_counts[-1] != len(angles):
+                raise ValueError(f"{registry_path} has {angle_counts[-1]} angles but {angles_path} has {len(angles)}")
+        return cls(shapes, angles, angle_counts=angle_counts)
+
+    def __len__(self):
+        return self.num_pairs
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.records(np.arange(*key.indices(self.num_pairs), dtype=np.uint64))
+        if np.ndim(key) == 0:
+            return self.records([key])[0]
+        return self.records(key)
+
+    # The pair records for an array of pair ids, in one vectorized pass
+    def records(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) and (ids.min() < 0 or ids.max() >= self.num_pairs):
+            raise IndexError(f"Pair ids must be in [0, {self.num_pairs})")
+        return pair_table.records_from_ids(ids, self.num_shapes, self.num_angles, self.label_ids, self.angle_counts)
+
+    # (shape_a, angle_a, shape_b, angle_b, same) of one pair, with angles as (angle_x, angle_y)
+    def pair(self, pair_id):
+        record = self[pair_id]
+        return (int(record["shape_a"]), tuple(self.angles[record["angle_a"]].tolist()),
+                int(record["shape_b"]), tuple(self.angles[record["angle_b"]].tolist()), bool(record["same"]))
+
+    # The paired_cubes.csv row of one pair, built from the tables rather than read from the file
+    def csv_row(self, pair_id):
+        if self.shape_cells is None:
+            self.shape_cells = pair_table.shape_csv_cells(self.shapes)
+        record = self[pair_id]
+        return ([int(record["id"]), bool(record["same"])]
+                + self.shape_cells[record["shape_a"]] + self.angles[record["angle_a"]].tolist()
+                + self.shape_cells[record["shape_b"]] + self.angles[record["angle_b"]].tolist())
+
+# Mix the bits of uint64 values (the splitmix64 finalizer), the round function of PairPermutation
+def mix64(x):
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+# A keyed random order of [0, size) that is computed rather than stored: position p of the order is self[p], and index()
+# maps ids back to their positions. Any slice of any epoch's order costs O(1) per id, so a shuffled epoch can be streamed
+# or resumed from any position with nothing on disk. The same size, seed and epoch always give the same order.
+#
+# The order is a balanced Feistel network on the smallest even number of bits covering size, which is a bijection on
+# that power-of-4 domain. Values that land outside [0, size) are encrypted again (cycle walking) until they land inside,
+# which keeps it a bijection of [0, size) and takes fewer than 4 rounds on average since the domain is under 4 * size.
+class PairPermutation:
+    def __init__(self, size, seed=0, epoch=0, rounds=4):
+        self.size = size
+        self.half_bits = np.uint64(max(1, -(-max(size - 1, 1).bit_length() // 2)))
+        self.mask = np.uint64((1 << int(self.half_bits)) - 1)
+        self.keys = np.random.SeedSequence((seed, epoch)).generate_state(rounds, dtype=np.uint64)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.walk(np.arange(*key.indices(self.size), dtype=np.uint64), self.encrypt)
+        if np.ndim(key) == 0:
+            return int(self.walk(self.check([key]), self.encrypt)[0])
+        return self.walk(self.check(key), self.encrypt)
+
+    # The positions of the given ids in this order, the inverse of indexing
+    def index(self, ids):
+        return self.walk(self.check(ids), self.decrypt)
+
+    def check(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        if len(values) and (values.min() < 0 or values.max() >= self.size):
+            raise IndexError(f"Values must be in [0, {self.size})")
+        return values.astype(np.uint64)
+
+    def encrypt(self, values):
+        left, right = values >> self.half_bits, values & self.mask
+        for key in self.keys:
+            left, right = right, left ^ (mix64(right ^ key) & self.mask)
+        return (left << self.half_bits) | right
+
+    def decrypt(self, values):
+        left, right = values >> self.half_bits, values & self.mask
+        for key in self.keys[::-1]:
+            left, right = right ^ (mix64(left ^ key) & self.mask), left
+        return (left << self.half_bits) | right
+
+    # Apply a round of the network until every value is back inside [0, size)
+    def walk(self, values, step):
+        values = step(values)
+        outside = np.flatnonzero(values >= np.uint64(self.size))
+        while len(outside):
+            values[outside] = step(values[outside])
+            outside = outside[values[outside] >= np.uint64(self.size)]
+        return values
+
+    # Yield the ids at positions [start, stop) of the order, chunk_size at a time
+    def chunks(self, start=0, stop=None, chunk_size=1 << 20):
+        stop = self.size if stop is None else min(stop, self.size)
+        for chunk_start in range(start, stop, chunk_size):
+            yield self[chunk_start:min(chunk_start + chunk_size, stop)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up pairs by id from the shape and angle tables, or list a shuffled epoch order.")
+    parser.add_argument('ids', type=int, nargs='*', help='Pair ids to decode, or positions in the shuffled order with --seed')
+    parser.add_argument('--shapes', type=str, default="shapes.npy", help='Shape table written by data-generate.py --format npy')
+    parser.add_argument('--angles', type=str, default="angles.npy", help='Angle table written by data-generate.py --format npy')
+    parser.add_argument('--angle-registry', type=str, default="angle_registry.json", help='Angle registry saved by data-generate.py. Needed after --refine')
+    parser.add_argument('--seed', type=int, default=None, help='Treat the ids as positions in the shuffled order of this seed')
+    parser.add_argument('--epoch', type=int, default=0, help='Epoch of the shuffled order (with --seed)')
+    args = parser.parse_args()
+
+    index = PairIndex.load(args.shapes, args.angles, args.angle_registry)
+    ids = args.ids
+    if args.seed is not None:
+        ids = PairPermutation(len(index), args.seed, args.epoch)[ids].tolist()
+    print(f"{len(index)} pairs")
+    writer = csv.writer(sys.stdout, lineterminator="\n")
+    for pair_id in ids:
+        writer.writerow(index.csv_row(pair_id))
@@ -0,0 +1,144 @@
+import numpy as np
+from pair_table import encode_pair_ids, records_from_ids, single_counts
+
+# Shapes grouped into strata by block count, or one stratum of all shapes: the shape ids in stratum order,
+# with the offset and number of shapes of every stratum
+def shape_strata(shape_blocks, by_blocks):
+    if not by_blocks:
+        return np.arange(len(shape_blocks)), np.zeros(1, dtype=np.int64), np.array([len(shape_blocks)])
+    order = np.argsort(shape_blocks, kind="stable")
+    _, offsets, counts = np.unique(shape_blocks[order], return_index=True, return_counts=True)
+    return order, offsets, counts
+
+# Number of samples for every stratum: an equal share, capped at the stratum's capacity (its number of distinct pairs),
+# with the share a full stratum cannot take handed on to the strata that still have room
+def stratum_quotas(num_samples, capacities):
+    capacities = np.asarray(capacities, dtype=np.int64)
+    if num_samples > capacities.sum():
+        raise ValueError("More samples requested than there are distinct pairs")
+    quotas = np.zeros(len(capacities), dtype=np.int64)
+    remaining = num_samples
+    while remaining:
+        open_strata = np.flatnonzero(quotas < capacities)
+        share = np.full(len(open_strata), remaining // len(open_strata))
+        share[:remaining % len(open_strata)] += 1
+        added = np.minimum(share, capacities[open_strata] - quotas[open_strata])
+        quotas[open_strata] += added
+        remaining -= int(added.sum())
+    return quotas
+
+# Draw stratum_samples[s] shape ids from every stratum s of shape_strata, in random order
+def sample_shapes(rng, strata, stratum_samples, by_blocks):
+    order, offsets, counts = strata
+    if not by_blocks:
+        return rng.integers(0, len(order), int(stratum_samples.sum()))
+    stratum = rng.permutation(np.repeat(np.arange(len(counts)), stratum_samples))
+    return order[offsets[stratum] + (rng.random(len(stratum)) * counts[stratum]).astype(np.int64)]
+
+# Draw num_samples (angle_a, angle_b) pairs, optionally spread evenly across angle deltas on the angle grid
+# angle_grid maps grid positions to angle ids when the ids are not in grid order (see AngleRegistry.grid)
+# Without even, deltas are drawn at random instead, so small top-up draws are not all given the smallest deltas
+def sample_angles(rng, num_angles, num_samples, angle_steps, by_delta, angle_grid=None, even=True):
+    angle_a = rng.integers(0, num_angles, num_samples)
+    if not by_delta:
+        return angle_a, rng.integers(0, num_angles, num_samples)
+
+    # Grid positions follow list_all_angles: position = x step * angle_steps + y step
+    if even:
+        delta = rng.permutation(np.arange(num_samples) % num_angles)
+    else:
+        delta = rng.integers(0, num_angles, num_samples)
+    x_a, y_a = np.divmod(angle_a, angle_steps)
+    x_d, y_d = np.divmod(delta, angle_steps)
+    angle_b = ((x_a + x_d) % angle_steps) * angle_steps + (y_a + y_d) % angle_steps
+    if angle_grid is None:
+        return angle_a, angle_b
+    return angle_grid[angle_a], angle_grid[angle_b]
+
+# Number of distinct views of each shape: every angle, or only the representative ones of view_aliases
+def view_counts(num_shapes, num_angles, view_aliases=None):
+    if view_aliases is None:
+        return np.full(num_shapes, num_angles, dtype=np.int64)
+    return (np.asarray(view_aliases) == np.arange(num_angles)).sum(axis=1)
+
+# Draw num_samples distinct pairs that are all SAME or all DIFFERENT
+# With view_aliases, angles are replaced by their representative view, so pairs that would show the same images are drawn once
+def sample_group(rng, shape_blocks, num_angles, num_samples, same, angle_steps, by_blocks, by_delta, view_aliases=None,
+                 angle_counts=None, angle_grid=None, max_rounds=1000):
+    num_shapes = len(shape_blocks)
+    counts = single_counts(num_shapes, num_angles, angle_counts)
+    strata = shape_strata(shape_blocks, by_blocks)
+    order, offsets, shape_counts = strata
+    shape_stratum = np.empty(num_shapes, dtype=np.int64)
+    shape_stratum[order] = np.repeat(np.arange(len(shape_counts)), shape_counts)
+
+    # Quotas follow the distinct pairs each stratum has: pairs whose first shape is in the stratum
+    views = view_counts(num_shapes, num_angles, view_aliases)[order]
+    shape_capacity = views ** 2 if same else views * (views.sum() - views)
+    quotas = stratum_quotas(num_samples, np.add.reduceat(shape_capacity, offsets))
+
+    # Duplicates are dropped and topped up with fresh draws until every stratum has its quota of distinct pairs.
+    # Top-ups draw at least twice what is missing, and the first new pairs of each stratum are kept
+    ids = np.zeros(0, dtype=np.uint64)
+    id_strata = np.zeros(0, dtype=np.int64)
+    needed = quotas
+    for draw_round in range(max_rounds):
+        if not needed.any():
+            return ids
+        draws = needed if draw_round == 0 else np.where(needed > 0, np.maximum(2 * needed, 1024), 0)
+        shape_a = sample_shapes(rng, strata, draws, by_blocks)
+        count = len(shape_a)
+        if same:
+            shape_b = shape_a
+        else:
+            shape_b = (shape_a + rng.integers(1, num_shapes, count)) % num_shapes
+        angle_a, angle_b = sample_angles(rng, num_angles, count, angle_steps, by_delta, angle_grid, even=draw_round == 0)
+        if view_aliases is not None:
+            angle_a, angle_b = view_aliases[shape_a, angle_a], view_aliases[shape_b, angle_b]
+
+        i = angle_a.astype(np.uint64) * num_shapes + shape_a
+        j = angle_b.astype(np.uint64) * num_shapes + shape_b
+        ids = np.concatenate([ids, encode_pair_ids(i, j, counts)])
+        id_strata = np.concatenate([id_strata, shape_stratum[shape_a]])
+        first = np.sort(np.unique(ids, return_index=True)[1])
+        ids, id_strata = ids[first], id_strata[first]
+
+        # Rank of every pair among the pairs of its stratum, in draw order
+        by_stratum = np.argsort(id_strata, kind="stable")
+        rank = np.empty(len(ids), dtype=np.int64)
+        rank[by_stratum] = np.arange(len(ids)) - np.searchsorted(id_strata[by_stratum], id_strata[by_stratum])
+        keep = rank < quotas[id_strata]
+        ids, id_strata = ids[keep], id_strata[keep]
+        needed = quotas - np.bincount(id_strata, minlength=len(quotas))
+
+    raise ValueError(f"Could not draw {num_samples} distinct pairs in {max_rounds} rounds")
+
+# Sample a reproducible, stratified subset of all pairs without enumerating the full pair space.
+# Runs in O(num_samples) time and memory. The same seed and arguments always give the same pairs.
+# label_ids only affects how the sampled pairs are labelled (see ShapeRegistry.label_ids).
+# With by_blocks, a block count with fewer distinct pairs than its share gets all of them, and the rest go to the others.
+# view_aliases (see ShapeRegistry.view_aliases) makes pairs only use representative views, skipping pairs of identical images.
+# angle_counts and angle_grid describe refined angle registries (see AngleRegistry.angle_counts and AngleRegistry.grid).
+def sample_pairs(shape_blocks, num_angles, num_samples, same_ratio=0.5, seed=0, angle_steps=None, by_blocks=False, by_delta=False, label_ids=None, view_aliases=None,
+                 angle_counts=None, angle_grid=None):
+    if by_delta and angle_steps is None:
+        raise ValueError("Stratifying by angle delta needs the number of angle steps per axis")
+    if len(shape_blocks) < 2 and same_ratio < 1:
+        raise ValueError("DIFFERENT pairs need at least two shapes")
+
+    rng = np.random.default_rng(seed)
+    shape_blocks = np.asarray(shape_blocks)
+    num_shapes = len(shape_blocks)
+    num_same = int(round(num_samples * same_ratio))
+
+    if view_aliases is not None:
+        view_aliases = np.asarray(view_aliases)
+    num_views = view_counts(num_shapes, num_angles, view_aliases)
+    same_pairs = int((num_views ** 2).sum())
+    if num_same > same_pairs or num_samples - num_same > int(num_views.sum()) ** 2 - same_pairs:
+        raise ValueError("More samples requested than there are distinct pairs")
+
+    same_ids = sample_group(rng, shape_blocks, num_angles, num_same, True, angle_steps, by_blocks, by_delta, view_aliases, angle_counts, angle_grid)
+    different_ids = sample_group(rng, shape_blocks, num_angles, num_samples - num_same, False, angle_steps, by_blocks, by_delta, view_aliases,
+                                 angle_counts, angle_grid)
+    return records_from_ids(np.sort(np.concatenate([same_ids, different_ids])), num_shapes, num_angles, label_ids, angle_counts)
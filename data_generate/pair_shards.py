@@ -0,0 +1,164 @@
+import csv
+import hashlib
+import json
+import os
+import re
+import tempfile
+import numpy as np
+import pair_table
+
+# Parse a --shard argument of the form "k/N" into (k, N), with 0 <= k < N
+def parse_shard(shard):
+    k, n = (int(part) for part in shard.split("/"))
+    if not 0 <= k < n:
+        raise ValueError(f"Shard {shard} is out of range, expected k/N with 0 <= k < N")
+    return k, n
+
+# The chunks owned by shard k of n: a contiguous run of chunk indices, so every shard covers a disjoint id range
+def shard_chunks(num_pairs, chunk_size, k, n):
+    num_chunks = -(-num_pairs // chunk_size)
+    return range(k * num_chunks // n, (k + 1) * num_chunks // n)
+
+def chunk_file_name(chunk, file_format):
+    return f"paired_cubes_{chunk:06d}.{file_format}"
+
+def manifest_path(out_dir, k, n):
+    return os.path.join(out_dir, f"manifest_{k}_of_{n}.json")
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Write a file under a temporary name in the same directory, then move it into place.
+# write(path) does the writing. Readers only ever see a missing or a complete file.
+def write_atomic(path, write):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp_")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def save_manifest(path, manifest):
+    def write(tmp_path):
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+    write_atomic(path, write)
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# True if a chunk recorded in the manifest is on disk with the recorded size and checksum
+def chunk_is_valid(out_dir, entry):
+    path = os.path.join(out_dir, entry["file"])
+    return os.path.exists(path) and os.path.getsize(path) == entry["bytes"] and file_sha256(path) == entry["sha256"]
+
+# The manifest of a run before the angle grid was refined, keeping only its whole chunks of pairs among the earlier angles.
+# Pair ids of earlier angles do not change when angles are appended (see pair_table.decode_pair_ids), so those chunks are still valid.
+# Returns None when the manifest is for other settings.
+def refined_manifest(manifest, settings):
+    old = manifest["settings"]
+    old_counts = old.get("angle_counts", [old["num_angles"]])
+    ignored = ("num_angles", "angle_counts", "shard")
+    if ({key: value for key, value in old.items() if key not in ignored}
+            != {key: value for key, value in settings.items() if key not in ignored}
+            or settings.get("angle_counts", [settings["num_angles"]])[:len(old_counts)] != old_counts):
+        return None
+    old_pairs = (settings["num_shapes"] * old["num_angles"]) ** 2
+    chunks = {chunk: entry for chunk, entry in manifest["chunks"].items()
+              if entry["id_stop"] <= old_pairs and entry["rows"] == settings["chunk_size"]}
+    return {"settings": settings, "chunks": chunks}
+
+# The chunks recorded by every shard manifest in out_dir that are still valid for settings: all chunks of a manifest
+# with the same settings, whatever shard wrote it, and the whole chunks of earlier angles of one from before a refinement.
+# Shards own other chunk ranges once the number of chunks changes, so a shard can find its chunks in any manifest
+def known_chunks(out_dir, settings):
+    chunks = {}
+    for name in sorted(os.listdir(out_dir)):
+        if not re.fullmatch(r"manifest_\d+_of_\d+\.json", name):
+            continue
+        manifest = load_manifest(os.path.join(out_dir, name))
+        if manifest is None:
+            continue
+        if {**manifest["settings"], "shard": settings["shard"]} == settings:
+            chunks.update(manifest["chunks"])
+        else:
+            refined = refined_manifest(manifest, settings)
+            if refined is not None:
+                chunks.update(refined["chunks"])
+    return chunks
+
+# Write the pairs of shard k of n as chunk files in out_dir, each committed atomically and recorded in the shard's manifest.
+# With resume, chunks already in a manifest in out_dir are verified against their checksum and only missing or corrupt ones are regenerated.
+# That includes manifests of other shards and manifests written before the angle grid was refined, whose chunks of earlier angles are kept.
+def write_shard(registry, angles, label_ids, out_dir, k, n, file_format="csv", chunk_size=1 << 22, workers=None, resume=False, angle_counts=None):
+    os.makedirs(out_dir, exist_ok=True)
+    num_shapes, num_angles, num_cubes = len(registry), len(angles), registry.num_cubes
+    num_pairs = (num_shapes * num_angles) ** 2
+    workers = workers or os.cpu_count()
+
+    path = manifest_path(out_dir, k, n)
+    settings = {"num_shapes": num_shapes, "num_angles": num_angles, "num_cubes": num_cubes,
+                "label_ids_sha256": hashlib.sha256(np.asarray(label_ids, dtype=np.uint32).tobytes()).hexdigest(),
+                "format": file_format, "chunk_size": chunk_size, "shard": f"{k}/{n}"}
+    if angle_counts is not None and len(angle_counts) > 1:
+        settings["angle_counts"] = list(angle_counts)
+    known = known_chunks(out_dir, settings) if resume else {}
+    if resume and not known:
+        print("No matching manifest, generating the whole shard")
+
+    chunks = shard_chunks(num_pairs, chunk_size, k, n)
+    manifest = {"settings": settings, "chunks": {str(chunk): known[str(chunk)] for chunk in chunks
+                                                 if str(chunk) in known and chunk_is_valid(out_dir, known[str(chunk)])}}
+    todo = [chunk for chunk in chunks if str(chunk) not in manifest["chunks"]]
+    print(f"Shard {k}/{n}: chunks {chunks.start}-{chunks.stop - 1}, {len(chunks) - len(todo)} complete, {len(todo)} to generate")
+    if not todo:
+        save_manifest(path, manifest)
+        return
+
+    pool = None
+    if file_format == "csv":
+        fragments = pair_table.single_csv_fragments(registry.csv_cells, angles)
+        pool = pair_table.csv_pool(fragments, label_ids, workers, pair_table.single_counts(num_shapes, num_angles, angle_counts))
+
+    try:
+        for done, chunk in enumerate(todo):
+            id_start = chunk * chunk_size
+            id_stop = min(id_start + chunk_size, num_pairs)
+
+            def write(tmp_path):
+                if file_format == "csv":
+                    with open(tmp_path, "w", newline='') as f:
+                        csv.writer(f).writerow(pair_table.csv_header(num_cubes))
+                        pair_table.write_csv_rows(f, pool, workers, id_start, id_stop)
+                else:
+                    with open(tmp_path, "wb") as f:
+                        np.save(f, pair_table.pair_records(id_start, id_stop, num_shapes, num_angles, label_ids, angle_counts))
+
+            file_name = chunk_file_name(chunk, file_format)
+            write_atomic(os.path.join(out_dir, file_name), write)
+            manifest["chunks"][str(chunk)] = {
+                "file": file_name,
+                "id_start": id_start,
+                "id_stop": id_stop,
+                "rows": id_stop - id_start,
+                "bytes": os.path.getsize(os.path.join(out_dir, file_name)),
+                "sha256": file_sha256(os.path.join(out_dir, file_name)),
+            }
+            save_manifest(path, manifest)
+            print(f"\rShard {k}/{n}: {round((done + 1) / len(todo) * 100, 2)}%", end="")
+        print()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
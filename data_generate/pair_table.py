@@ -0,0 +1,318 @@
+import argparse
+import csv
+import io
+import os
+import numpy as np
+from collections import deque
+from multiprocessing import Pool
+from polycube_generator import metrics
+
+# Fixed-width record for one image pair. Shapes and angles are indices into the shape and angle tables.
+PAIR_DTYPE = np.dtype([
+    ("id", "<u8"),
+    ("shape_a", "<u4"),
+    ("angle_a", "<u2"),
+    ("shape_b", "<u4"),
+    ("angle_b", "<u2"),
+    ("same", "u1"),
+])
+
+# Build the shape table: number of blocks and block positions for every polycube, zero-padded to num_cubes blocks
+def shape_table(polycubes, num_cubes):
+    dtype = np.dtype([("num_blocks", "u1"), ("blocks", "i1", (num_cubes, 3))])
+    table = np.zeros(len(polycubes), dtype=dtype)
+    for shape_id, coords in enumerate(polycubes):
+        table[shape_id]["num_blocks"] = len(coords)
+        table[shape_id]["blocks"][:len(coords)] = coords
+    return table
+
+# Build the angle table: (angle_x, angle_y) for every viewing angle
+def angle_table(angles):
+    return np.array(angles, dtype=np.uint16).reshape(-1, 2)
+
+# Write the shape and angle tables that pair records refer to,
+# and the (num_shapes, num_angles) alias table mapping each view to its representative angle id
+def write_tables(registry, angles, shapes_path="shapes.npy", angles_path="angles.npy", aliases_path="view_aliases.npy"):
+    np.save(shapes_path, registry.table)
+    np.save(angles_path, angle_table(angles))
+    np.save(aliases_path, registry.view_aliases(angles))
+
+# Pair ids that stay the same when a refinement appends angles (see AngleRegistry).
+# single_counts is the number of singles after each angle registry version. Pairs among the first single_counts[0] singles
+# have id i * single_counts[0] + j. Each later version numbers only the pairs it adds, after all the earlier ones:
+# first every earlier single with each new single, then each new single with every single.
+# With one version this is i * num_singles + j, and after any version v the ids run from 0 to single_counts[v] ** 2.
+def encode_pair_ids(i, j, single_counts):
+    i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+    counts = np.asarray(single_counts, dtype=np.int64)
+    version = np.searchsorted(counts, np.maximum(i, j), side="right")
+    total = counts[version]
+    previous = np.concatenate([[0], counts])[version]
+    added = total - previous
+    ids = np.where(i < previous, i * added + (j - previous), previous * added + (i - previous) * total + j)
+    return (previous * previous + ids).astype(np.uint64)
+
+# The (i, j) singles of each pair id, inverting encode_pair_ids in O(1) per id
+def decode_pair_ids(ids, single_counts):
+    ids = np.asarray(ids, dtype=np.uint64)
+    if len(single_counts) == 1:
+        return np.divmod(ids, np.uint64(single_counts[0]))
+    ids = ids.astype(np.int64)
+    counts = np.asarray(single_counts, dtype=np.int64)
+    version = np.searchsorted(counts * counts, ids, side="right")
+    total = counts[version]
+    previous = np.concatenate([[0], counts])[version]
+    added = total - previous
+    local = ids - previous * previous
+    rest = np.maximum(local - previous * added, 0)
+    in_earlier = local < previous * added
+    i = np.where(in_earlier, local // added, previous + rest // total)
+    j = np.where(in_earlier, previous + local % added, rest % total)
+    return i.astype(np.uint64), j.astype(np.uint64)
+
+# Build the pair records for an array of pair ids in one vectorized pass.
+# Single images are ordered like the angles/polycubes cross join: single k is shape k % num_shapes at angle k // num_shapes.
+# Pair id i * num_singles + j pairs single i with single j, or follows decode_pair_ids when angle_counts
+# (the number of angles after each angle registry version, see AngleRegistry.angle_counts) has several versions.
+# Pairs are SAME when their label ids match (see ShapeRegistry.label_ids), or their shape ids when label_ids is None.
+def records_from_ids(ids, num_shapes, num_angles, label_ids=None, angle_counts=None):
+    ids = np.asarray(ids, dtype=np.uint64)
+    i, j = decode_pair_ids(ids, single_counts(num_shapes, num_angles, angle_counts))
+
+    records = np.empty(len(ids), dtype=PAIR_DTYPE)
+    records["id"] = ids
+    records["shape_a"], records["angle_a"] = i % num_shapes, i // num_shapes
+    records["shape_b"], records["angle_b"] = j % num_shapes, j // num_shapes
+    if label_ids is None:
+        records["same"] = records["shape_a"] == records["shape_b"]
+    else:
+        records["same"] = label_ids[records["shape_a"]] == label_ids[records["shape_b"]]
+    return records
+
+# Number of singles after each angle registry version, one version of num_angles when angle_counts is None
+def single_counts(num_shapes, num_angles, angle_counts=None):
+    return [num_shapes * count for count in (angle_counts or [num_angles])]
+
+# Build the pair records for ids [id_start, id_stop)
+def pair_records(id_start, id_stop, num_shapes, num_angles, label_ids=None, angle_counts=None):
+    return records_from_ids(np.arange(id_start, id_stop, dtype=np.uint64), num_shapes, num_angles, label_ids, angle_counts)
+
+# Write every pair from id_start onwards to a memory-mappable .npy file, chunk_size records at a time
+def write_pair_table(path, num_shapes, num_angles, id_start=0, label_ids=None, chunk_size=1 << 22, angle_counts=None):
+    num_pairs = (num_shapes * num_angles) ** 2
+    table = np.lib.format.open_memmap(path, mode="w+", dtype=PAIR_DTYPE, shape=(num_pairs - id_start,))
+    fill_pair_table(table, id_start, id_start, num_pairs, num_shapes, num_angles, label_ids, chunk_size, angle_counts)
+    del table
+
+# Number of leading records of a pair table written from id 0 that hold the pairs they should.
+# Records are filled in id order and the rest of the file is zeros, so the written part is found by binary search.
+def written_pairs(table, num_shapes, num_angles, label_ids=None, angle_counts=None):
+    low, high = 0, len(table)
+    while low < high:
+        middle = (low + high) // 2
+        expected = pair_records(middle, middle + 1, num_shapes, num_angles, label_ids, angle_counts)
+        if table[middle:middle + 1] == expected:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+# Grow a pair table written from id 0 to every pair of num_angles angles, after a refinement appended angles.
+# Only the pairs it is missing are computed, from the end of its written records, so an interrupted run resumes
+# where it stopped. The existing records are not rewritten when the .npy header has room for the new length,
+# which it has unless the number of digits crosses its padding.
+def extend_pair_table(path, num_shapes, num_angles, label_ids=None, chunk_size=1 << 22, angle_counts=None):
+    num_pairs = (num_shapes * num_angles) ** 2
+    existing = np.load(path, mmap_mode="r")
+    if existing.dtype != PAIR_DTYPE or existing.ndim != 1 or len(existing) > num_pairs:
+        raise ValueError(f"{path} is not a pair table written from id 0 that can grow to {num_pairs} pairs")
+    id_start = written_pairs(existing, num_shapes, num_angles, label_ids, angle_counts)
+    full_length = len(existing) == num_pairs
+    del existing
+    if id_start == num_pairs:
+        print(f"All {num_pairs} pairs are already written")
+        return
+    grown = full_length
+    if not full_length:
+        with open(path, "r+b") as f:
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            read_header(f)
+            data_offset = f.tell()
+            header = repr({"descr": np.lib.format.dtype_to_descr(PAIR_DTYPE), "fortran_order": False, "shape": (num_pairs,)})
+            length_bytes = 2 if version == (1, 0) else 4
+            header_size = data_offset - 8 - length_bytes
+            if len(header) + 1 <= header_size:
+                f.seek(8 + length_bytes)
+                f.write((header.ljust(header_size - 1) + "\n").encode("latin1"))
+                f.truncate(data_offset + num_pairs * PAIR_DTYPE.itemsize)
+                grown = True
+
+    if not grown:
+        # The header has to get longer, so write a new file with the existing records copied in
+        existing = np.load(path, mmap_mode="r")
+        tmp_path = path + ".tmp.npy"
+        table = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=PAIR_DTYPE, shape=(num_pairs,))
+        table[:id_start] = existing[:id_start]
+        del existing
+    else:
+        table = np.load(path, mmap_mode="r+")
+    print(f"Extending pair table from {id_start} to {num_pairs} pairs")
+    fill_pair_table(table, 0, id_start, num_pairs, num_shapes, num_angles, label_ids, chunk_size, angle_counts)
+    del table
+    if not grown:
+        os.replace(tmp_path, path)
+
+# Fill table with the pair records for ids [id_start, id_stop), chunk_size records at a time. table[0] holds id table_start
+def fill_pair_table(table, table_start, id_start, id_stop, num_shapes, num_angles, label_ids, chunk_size, angle_counts):
+    for chunk_start in range(id_start, id_stop, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, id_stop)
+        table[chunk_start - table_start:chunk_stop - table_start] = pair_records(chunk_start, chunk_stop, num_shapes, num_angles, label_ids, angle_counts)
+        metrics.count("rows", chunk_stop - chunk_start)
+        metrics.count("bytes_written", (chunk_stop - chunk_start) * PAIR_DTYPE.itemsize)
+        metrics.gauge("progress", (chunk_stop - id_start) / (id_stop - id_start))
+        metrics.tick()
+        print(f"\rWriting pairs: {round(chunk_stop / id_stop * 100, 2)}%", end="")
+    table.flush()
+    print()
+
+# The id to resume paired_cubes.csv at: one past the id of its last complete row, or 0 when it has no rows.
+# A row cut off by an interrupted run is truncated away, and so is a lone header, which is written again from id 0.
+# Raises ValueError, leaving the file as it is, when the last complete row is not a pair row
+def csv_resume_id(csv_path, tail_size=1 << 16):
+    with open(csv_path, "r+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        tail_start = max(0, size - tail_size)
+        f.seek(tail_start)
+        tail = f.read()
+        rows_end = tail.rfind(b"\n") + 1
+        if not rows_end:
+            if tail_start:
+                raise ValueError(f"{csv_path} has no complete row in its last {tail_size} bytes")
+            # Not even the header was written in full
+            f.truncate(0)
+            return 0
+        lines = tail[:rows_end].splitlines()
+        last_row = lines[-1]
+        if not tail_start and len(lines) == 1 and last_row.startswith(b"id,"):
+            f.truncate(0)
+            return 0
+        try:
+            next_id = int(last_row.split(b",", 1)[0]) + 1
+        except ValueError:
+            raise ValueError(f"Cannot resume {csv_path}: its last complete row is not a pair row") from None
+        f.truncate(tail_start + rows_end)
+        return next_id
+
+# Header of paired_cubes.csv
+def csv_header(num_cubes):
+    header = ["id", "SAME", "im_1_num_blocks"]
+    header.extend(f"im_1_block_{i}_pos" for i in range(1, num_cubes + 1))
+    header.extend(["im_1_angle_x", "im_1_angle_y", "im_2_num_blocks"])
+    header.extend(f"im_2_block_{i}_pos" for i in range(1, num_cubes + 1))
+    header.extend(["im_2_angle_x", "im_2_angle_y"])
+    return header
+
+# The CSV cells for each shape, computed once: number of blocks, then block positions padded with "()"
+def shape_csv_cells(shapes):
+    num_cubes = shapes["blocks"].shape[1]
+    shape_cells = []
+    for shape in shapes:
+        num_blocks = int(shape["num_blocks"])
+        blocks = [tuple(block) for block in shape["blocks"][:num_blocks].tolist()]
+        shape_cells.append([num_blocks] + blocks + ["()"] * (num_cubes - num_blocks))
+    return shape_cells
+
+# The CSV text for every single image (shape cells then angle cells), in cross join order.
+# Formatted with csv.writer so quoting matches rows written by csv.writer exactly.
+def single_csv_fragments(shape_cells, angles):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for angle in angles:
+        for cells in shape_cells:
+            writer.writerow(cells + list(angle))
+    return buffer.getvalue().splitlines()
+
+# Per-process state for csv_block, set once by init_csv_worker so blocks only carry their id range
+_csv_fragments = None
+_csv_label_ids = None
+_csv_single_counts = None
+
+def init_csv_worker(fragments, label_ids, single_counts=None):
+    global _csv_fragments, _csv_label_ids, _csv_single_counts
+    _csv_fragments = fragments
+    _csv_label_ids = label_ids
+    _csv_single_counts = single_counts or [len(fragments)]
+
+# Format the paired_cubes.csv rows for ids [id_start, id_stop) as one string.
+# SAME is computed for the whole block with one array comparison.
+def csv_block(id_range):
+    id_start, id_stop = id_range
+    i, j = decode_pair_ids(np.arange(id_start, id_stop, dtype=np.uint64), _csv_single_counts)
+    i, j = i.astype(np.int64), j.astype(np.int64)
+    num_shapes = len(_csv_label_ids)
+    same = np.where(_csv_label_ids[i % num_shapes] == _csv_label_ids[j % num_shapes], "True", "False")
+    fragments = _csv_fragments
+    return "".join([
+        f"{pair_id},{is_same},{fragments[a]},{fragments[b]}\r\n"
+        for pair_id, is_same, a, b in zip(range(id_start, id_stop), same.tolist(), i.tolist(), j.tolist())
+    ])
+
+# Start a process pool ready to format paired_cubes.csv blocks with csv_block.
+# single_counts (see decode_pair_ids) is only needed when the angles have several registry versions
+def csv_pool(fragments, label_ids, workers, single_counts=None):
+    return Pool(workers, initializer=init_csv_worker, initargs=(fragments, label_ids, single_counts))
+
+# Write the paired_cubes.csv rows for ids [id_start, id_stop) to f.
+# The range is split into contiguous blocks that the pool formats in one vectorized pass each.
+# Blocks are written in id order as single buffers, with at most 2 blocks per worker in flight.
+# Time spent waiting on the pool is counted as writer_stall, time spent in f.write as write.
+def write_csv_rows(f, pool, workers, id_start, id_stop, block_size=1 << 18):
+    pending = deque()
+    for block_start in range(id_start, id_stop, block_size):
+        block_stop = min(block_start + block_size, id_stop)
+        pending.append((pool.apply_async(csv_block, ((block_start, block_stop),)), block_stop - block_start))
+        if len(pending) >= 2 * workers:
+            write_csv_block(f, pending, (block_stop - id_start) / (id_stop - id_start))
+    while pending:
+        write_csv_block(f, pending, 1.0)
+
+# Write the oldest pending csv_block result to f, recording metrics for it
+def write_csv_block(f, pending, progress):
+    result, rows = pending.popleft()
+    with metrics.timer("writer_stall"):
+        text = result.get()
+    with metrics.timer("write"):
+        f.write(text)
+    metrics.count("rows", rows)
+    metrics.count("bytes_written", len(text))
+    metrics.gauge("queue_depth", len(pending))
+    metrics.gauge("progress", progress)
+    metrics.tick()
+
+# Convert a pair table back to the paired_cubes.csv columns, for consumers of the CSV format
+def pairs_to_csv(pairs, shapes, angles, csv_path, write_header=True, chunk_size=1 << 16):
+    num_cubes = shapes["blocks"].shape[1]
+    shape_cells = shape_csv_cells(shapes)
+    angle_cells = angles.tolist()
+
+    with open(csv_path, "w" if write_header else "a", newline='') as f:
+        writer = csv.writer(f)
+        if write_header:
+            writer.writerow(csv_header(num_cubes))
+        for chunk_start in range(0, len(pairs), chunk_size):
+            chunk = pairs[chunk_start:chunk_start + chunk_size]
+            writer.writerows(
+                [pair_id, bool(same)] + shape_cells[shape_a] + angle_cells[angle_a] + shape_cells[shape_b] + angle_cells[angle_b]
+                for pair_id, shape_a, angle_a, shape_b, angle_b, same in chunk.tolist()
+            )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a binary pair table to the paired_cubes.csv format.")
+    parser.add_argument('pairs', type=str, help='Path to the pair table written with --format npy')
+    parser.add_argument('-o', '--output', type=str, default="paired_cubes.csv", help='Path of the CSV file to write')
+    parser.add_argument('--shapes', type=str, default="shapes.npy", help='Path to the shape table')
+    parser.add_argument('--angles', type=str, default="angles.npy", help='Path to the angle table')
+    args = parser.parse_args()
+
+    pairs_to_csv(np.load(args.pairs, mmap_mode="r"), np.load(args.shapes), np.load(args.angles), args.output)
@@ -1,251 +1,815 @@
-import os
-import sys
-import math
-import numpy as np
-import argparse
-from time import perf_counter
-from matplotlib import pyplot as plt
-
-def all_rotations(polycube):
-    """
-    Calculates all rotations of a polycube.
-  
-    Adapted from https://stackoverflow.com/questions/33190042/how-to-calculate-all-24-rotations-of-3d-array.
-    This function computes all 24 rotations around each of the axis x,y,z. It uses numpy operations to do this, to avoid unecessary copies.
-    The function returns a generator, to avoid computing all rotations if they are not needed.
-  
-    Parameters:
-    polycube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
-
-    Returns:
-    generator(np.array): Yields new rotations of this cube about all axes
-  
-    """
-    def single_axis_rotation(polycube, axes):
-        """Yield four rotations of the given 3d array in the plane spanned by the given axes.
-        For example, a rotation in axes (0,1) is a rotation around axis 2"""
-        for i in range(4):
-             yield np.rot90(polycube, i, axes)
-
-    # 4 rotations about axis 0
-    yield from single_axis_rotation(polycube, (1,2))
-
-    # rotate 180 about axis 1, 4 rotations about axis 0
-    yield from single_axis_rotation(np.rot90(polycube, 2, axes=(0,2)), (1,2))
-
-    # rotate 90 or 270 about axis 1, 8 rotations about axis 2
-    yield from single_axis_rotation(np.rot90(polycube, axes=(0,2)), (0,1))
-    yield from single_axis_rotation(np.rot90(polycube, -1, axes=(0,2)), (0,1))
-
-    # rotate about axis 2, 8 rotations about axis 1
-    yield from single_axis_rotation(np.rot90(polycube, axes=(0,1)), (0,2))
-    yield from single_axis_rotation(np.rot90(polycube, -1, axes=(0,1)), (0,2))
-
-def crop_cube(cube):
-    """
-    Crops an np.array to have no all-zero padding around the edge.
-
-    Given in https://stackoverflow.com/questions/39465812/how-to-crop-zero-edges-of-a-numpy-array
-  
-    Parameters:
-    cube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
-  
-    Returns:
-    np.array: Cropped 3D Numpy byte array equivalent to cube, but with no zero padding
-  
-    """
-    for i in range(cube.ndim):
-        cube = np.swapaxes(cube, 0, i)  # send i-th axis to front
-        while np.all( cube[0]==0 ):
-            cube = cube[1:]
-        while np.all( cube[-1]==0 ):
-            cube = cube[:-1]
-        cube = np.swapaxes(cube, 0, i)  # send i-th axis to its original position
-    return cube
-
-def expand_cube(cube):
-    """
-    Expands a polycube by adding single blocks at all valid locations.
-  
-    Calculates all valid new positions of a polycube by shifting the existing cube +1 and -1 in each dimension.
-    New valid cubes are returned via a generator function, in case they are not all needed.
-  
-    Parameters:
-    cube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
-  
-    Returns:
-    generator(np.array): Yields new polycubes that are extensions of cube
-  
-    """
-    cube = np.pad(cube, 1, 'constant', constant_values=0)
-    output_cube = np.array(cube)
-
-    xs,ys,zs = cube.nonzero()
-    output_cube[xs+1,ys,zs] = 1
-    output_cube[xs-1,ys,zs] = 1
-    output_cube[xs,ys+1,zs] = 1
-    output_cube[xs,ys-1,zs] = 1
-    output_cube[xs,ys,zs+1] = 1
-    output_cube[xs,ys,zs-1] = 1
-
-    exp = (output_cube ^ cube).nonzero()
-
-    for (x,y,z) in zip(exp[0], exp[1], exp[2]):
-        new_cube = np.array(cube)
-        new_cube[x,y,z] = 1
-        yield crop_cube(new_cube)
-
-def generate_polycubes(n):
-    """
-    Generates all polycubes of size n
-  
-    Generates a list of all possible configurations of n cubes, where all cubes are connected via at least one face.
-    Builds each new polycube from the previous set of polycubes n-1.
-    Uses an optional cache to save and load polycubes of size n-1 for efficiency.
-  
-    Parameters:
-    n (int): The size of the polycubes to generate, e.g. all combinations of n=4 cubes.
-  
-    Returns:
-    list(np.array): Returns a list of all polycubes of size n as numpy byte arrays
-  
-    """
-    if n < 1:
-        return []
-    elif n == 1:
-        return [np.ones((1,1,1), dtype=np.byte)]
-    elif n == 2:
-        return [np.ones((2,1,1), dtype=np.byte)]
-
-    # Empty list of new n-polycubes
-    polycubes = []
-    polycubes_rle = set()
-
-    base_cubes = generate_polycubes(n-1)
-
-    for idx, base_cube in enumerate(base_cubes):
-        # Iterate over possible expansion positions
-        for new_cube in expand_cube(base_cube):
-            if not cube_exists_rle(new_cube, polycubes_rle):
-                polycubes.append(new_cube)
-                polycubes_rle.add(rle(new_cube))
-
-        if (idx % 100 == 0):               
-            perc = round((idx / len(base_cubes)) * 100,2)
-            print(f"\rGenerating polycubes n={n}: {perc}%", end="")
-
-    print(f"\rGenerating polycubes n={n}: 100%   ")
-
-    return polycubes
-
-def rle(polycube):
-    """
-    Computes a simple run-length encoding of a given polycube. This function allows cubes to be more quickly compared via hashing.
-  
-    Converts a {0,1} nd array into a tuple that encodes the same shape. The array is first flattened, and then the following algorithm is applied:
-
-    1) The first three values in tuple contain the x,y,z dimension sizes of the array
-    2) Each string of zeros of length n is replaced with a single value -n
-    3) Each string of ones of length m is replaced with a single value +m
-  
-    Parameters:
-    polycube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
-  
-    Returns:
-    tuple(int): Run length encoded polycube in the form (X, Y, Z, a, b, c, ...)
-
-    """
-    r = []
-    r.extend(polycube.shape)
-    current = None
-    val = 0
-    for x in polycube.flat:
-        if current is None:
-            current = x
-            val = 1
-            pass
-        elif current == x:
-            val += 1
-        elif current != x:
-            r.append(val if current == 1 else -val)
-            current = x
-            val = 1
-
-    r.append(val if current == 1 else -val)
-
-    return tuple(r)
-
-def cube_exists_rle(polycube, polycubes_rle):
-    """
-    Determines if a polycube has already been seen.
-  
-    Considers all possible rotations of a cube against the existing cubes stored in memory.
-    Returns True if the cube exists, or False if it is new.
-  
-    Parameters:
-    polycube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
-  
-    Returns:
-    boolean: True if polycube is already present in the set of all cubes so far.
-  
-    """
-    for cube_rotation in all_rotations(polycube):
-        if rle(cube_rotation) in polycubes_rle:
-            return True
-
-    return False
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-                    prog='Polycube Generator',
-                    description='Generates all polycubes (combinations of cubes) of size n.')
-
-    parser.add_argument('n', metavar='N', type=int,
-                    help='The number of cubes within each polycube')
-    
-    args = parser.parse_args()
-   
-    n = args.n
-
-    # Start the timer
-    t1_start = perf_counter()
-
-    all_cubes = list(generate_polycubes(n))
-
-    # Stop the timer
-    t1_stop = perf_counter()
-
-    print (f"Found {len(all_cubes)} unique polycubes")
-    print (f"Elapsed time: {round(t1_stop - t1_start,3)}s")
-
-
-# Code for if you want to generate pictures of the sets of cubes. Will work up to about n=8, before there are simply too many!
-# Could be adapted for larger cube sizes by splitting the dataset up into separate images.
-def render_shapes(shapes, path):
-    n = len(shapes)
-    dim = max(max(a.shape) for a in shapes)
-    i = math.isqrt(n) + 1
-    voxel_dim = dim * i
-    voxel_array = np.zeros((voxel_dim + i,voxel_dim + i,dim), dtype=np.byte)
-    pad = 1
-    for idx, shape in enumerate(shapes):
-        x = (idx % i) * dim + (idx % i)
-        y = (idx // i) * dim + (idx // i)
-        xpad = x * pad
-        ypad = y * pad
-        s = shape.shape
-        voxel_array[x:x + s[0], y:y + s[1] , 0 : s[2]] = shape
-
-    voxel_array = crop_cube(voxel_array)
-    colors = np.empty(voxel_array.shape, dtype=object)
-    colors[:] = '#FFD65DC0'
-
-    ax = plt.figure(figsize=(20,16), dpi=600).add_subplot(projection='3d')
-    ax.voxels(voxel_array, facecolors = colors, edgecolor='k', linewidth=0.1)
-    
-    ax.set_xlim([0, voxel_array.shape[0]])
-    ax.set_ylim([0, voxel_array.shape[1]])
-    ax.set_zlim([0, voxel_array.shape[2]])
-    plt.axis("off")
-    ax.set_box_aspect((1, 1, voxel_array.shape[2] / voxel_array.shape[0]))
-    plt.savefig(path + ".png", bbox_inches='tight', pad_inches = 0)
+import os
+import sys
+import math
+import tempfile
+import zipfile
+import numpy as np
+import argparse
+from multiprocessing import Pool
+from time import perf_counter
+from matplotlib import pyplot as plt
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+def all_rotations(polycube):
+    """
+    Calculates all rotations of a polycube.
+  
+    Adapted from https://stackoverflow.com/questions/33190042/how-to-calculate-all-24-rotations-of-3d-array.
+    This function computes all 24 rotations around each of the axis x,y,z. It uses numpy operations to do this, to avoid unecessary copies.
+    The function returns a generator, to avoid computing all rotations if they are not needed.
+  
+    Parameters:
+    polycube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
+
+    Returns:
+    generator(np.array): Yields new rotations of this cube about all axes
+  
+    """
+    def single_axis_rotation(polycube, axes):
+        """Yield four rotations of the given 3d array in the plane spanned by the given axes.
+        For example, a rotation in axes (0,1) is a rotation around axis 2"""
+        for i in range(4):
+             yield np.rot90(polycube, i, axes)
+
+    # 4 rotations about axis 0
+    yield from single_axis_rotation(polycube, (1,2))
+
+    # rotate 180 about axis 1, 4 rotations about axis 0
+    yield from single_axis_rotation(np.rot90(polycube, 2, axes=(0,2)), (1,2))
+
+    # rotate 90 or 270 about axis 1, 8 rotations about axis 2
+    yield from single_axis_rotation(np.rot90(polycube, axes=(0,2)), (0,1))
+    yield from single_axis_rotation(np.rot90(polycube, -1, axes=(0,2)), (0,1))
+
+    # rotate about axis 2, 8 rotations about axis 1
+    yield from single_axis_rotation(np.rot90(polycube, axes=(0,1)), (0,2))
+    yield from single_axis_rotation(np.rot90(polycube, -1, axes=(0,1)), (0,2))
+
+def crop_cube(cube):
+    """
+    Crops an np.array to have no all-zero padding around the edge.
+
+    Projects the array onto each axis with np.any and slices between the first and last occupied index.
+  
+    Parameters:
+    cube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
+  
+    Returns:
+    np.array: Cropped 3D Numpy byte array equivalent to cube, but with no zero padding
+  
+    """
+    occupied = cube != 0
+    slices = []
+    for i in range(cube.ndim):
+        projection = np.flatnonzero(occupied.any(axis=tuple(a for a in range(cube.ndim) if a != i)))
+        slices.append(slice(projection[0], projection[-1] + 1))
+    return cube[tuple(slices)]
+
+def expand_cube_batch(cube):
+    """
+    Builds every polycube that extends cube by a single block, as one stacked array.
+
+    All children share the padded shape of cube, so they are produced with a single np.repeat and one fancy-indexed assignment.
+    The base cube is already cropped, so each child's bounding box is the base box widened to include its new block.
+    These boxes are computed for the whole batch with a min/max over the new block coordinates.
+  
+    Parameters:
+    cube (np.array): Cropped 3D Numpy byte array where 1 values indicate polycube positions
+  
+    Returns:
+    tuple(np.array, np.array, np.array): (children, lo, hi) where children is an (m, X+2, Y+2, Z+2) byte array,
+    and child k cropped is children[k, lo[k,0]:hi[k,0], lo[k,1]:hi[k,1], lo[k,2]:hi[k,2]]
+  
+    """
+    cube = np.pad(cube, 1, 'constant', constant_values=0)
+    output_cube = np.array(cube)
+
+    xs,ys,zs = cube.nonzero()
+    output_cube[xs+1,ys,zs] = 1
+    output_cube[xs-1,ys,zs] = 1
+    output_cube[xs,ys+1,zs] = 1
+    output_cube[xs,ys-1,zs] = 1
+    output_cube[xs,ys,zs+1] = 1
+    output_cube[xs,ys,zs-1] = 1
+
+    exp = np.stack((output_cube ^ cube).nonzero(), axis=1)
+
+    children = np.repeat(cube[np.newaxis], len(exp), axis=0)
+    children[np.arange(len(exp)), exp[:,0], exp[:,1], exp[:,2]] = 1
+
+    # The base cube spans [1, dim] in the padded array
+    base_hi = np.array(cube.shape) - 1
+    lo = np.minimum(exp, 1)
+    hi = np.maximum(exp + 1, base_hi)
+
+    return children, lo, hi
+
+def expand_cube(cube):
+    """
+    Expands a polycube by adding single blocks at all valid locations.
+  
+    Calculates all valid new positions of a polycube by shifting the existing cube +1 and -1 in each dimension.
+    New valid cubes are returned via a generator function, in case they are not all needed.
+    The children are built together by expand_cube_batch, and each one yielded is a cropped view into that batch.
+    Copy a child before keeping it, so the whole batch is not kept alive with it.
+    cube may have zero padding, it is cropped first as expand_cube_batch expects.
+  
+    Parameters:
+    cube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
+  
+    Returns:
+    generator(np.array): Yields new polycubes that are extensions of cube
+  
+    """
+    children, lo, hi = expand_cube_batch(crop_cube(cube))
+    for k in range(len(children)):
+        yield children[k, lo[k,0]:hi[k,0], lo[k,1]:hi[k,1], lo[k,2]:hi[k,2]]
+
+def generate_polycubes(n, use_rle=False, workers=1, cache_dir=None):
+    """
+    Generates all polycubes of size n
+  
+    Generates a list of all possible configurations of n cubes, where all cubes are connected via at least one face.
+    Builds each new polycube from the previous set of polycubes n-1.
+    Uses an optional cache to save and load polycubes for efficiency, building up from the largest cached size below n.
+  
+    Parameters:
+    n (int): The size of the polycubes to generate, e.g. all combinations of n=4 cubes.
+    use_rle (bool): Deduplicate with the original run-length encoding instead of canonical keys. Slower, kept as a reference.
+    workers (int): Number of processes to split the base cubes across. The result is identical to a serial run.
+    cache_dir (str): Optional directory to load the largest cached size up to n from, and to save newly generated sizes to.
+  
+    Returns:
+    list(np.array): Returns a list of all polycubes of size n as numpy byte arrays
+  
+    """
+    if n < 1:
+        return []
+
+    polycubes = []
+    for _, polycubes in iter_levels(n, use_rle, workers, cache_dir, all_levels=False):
+        pass
+
+    return polycubes
+
+def iter_levels(n, use_rle=False, workers=1, cache_dir=None, all_levels=True):
+    """
+    Generates polycubes level by level, from size 1 up to size n.
+
+    Each level is built from the previous level exactly once, or loaded from the cache when present.
+    The previous level is dropped as soon as the next one is finished, so at most two levels are held in memory.
+    Without all_levels, the cache is probed from size n downwards and levels are only built up from the largest cached one,
+    so the levels below it are neither loaded nor rebuilt.
+
+    Parameters:
+    n (int): The largest size of polycubes to generate
+    use_rle (bool): Deduplicate with the original run-length encoding instead of canonical keys
+    workers (int): Number of processes to split each level across
+    cache_dir (str): Optional directory to load levels from, and to save newly generated levels to
+    all_levels (bool): Yield every size from 1, rather than only the sizes from the largest cached one up to n
+
+    Returns:
+    generator(tuple(int, list(np.array))): Yields (size, all polycubes of that size) for sizes 1 to n, in order
+
+    """
+    if use_rle and workers > 1:
+        raise ValueError("The run-length encoding reference path is serial only")
+
+    polycubes = []
+    start = 1
+    if not all_levels and cache_dir is not None:
+        for level in range(n, 2, -1):
+            cached = load_polycubes(level, cache_dir)
+            if cached is not None:
+                print(f"Loaded polycubes n={level} from cache")
+                polycubes, start = cached, level + 1
+                yield level, polycubes
+                break
+
+    for level in range(start, n + 1):
+        if level == 1:
+            polycubes = [np.ones((1,1,1), dtype=np.byte)]
+        elif level == 2:
+            polycubes = [np.ones((2,1,1), dtype=np.byte)]
+        else:
+            cached = load_polycubes(level, cache_dir) if cache_dir is not None else None
+            if cached is not None:
+                print(f"Loaded polycubes n={level} from cache")
+                polycubes = cached
+            else:
+                with metrics.phase("expand_level", n=level, base_cubes=len(polycubes)):
+                    polycubes = expand_level(polycubes, level, use_rle, workers)
+                if cache_dir is not None:
+                    save_polycubes(polycubes, level, cache_dir)
+
+        yield level, polycubes
+
+def iter_polycubes(n, use_rle=False, workers=1, cache_dir=None, coords=False):
+    """
+    Streams every polycube of size 1 up to size n.
+
+    Built on iter_levels, so every level is generated once and memory is bounded by two levels.
+  
+    Parameters:
+    n (int): The largest size of polycubes to generate
+    use_rle (bool): Deduplicate with the original run-length encoding instead of canonical keys
+    workers (int): Number of processes to split each level across
+    cache_dir (str): Optional directory to load levels from, and to save newly generated levels to
+    coords (bool): Yield compact coordinate arrays (see to_coords) instead of byte grids
+  
+    Returns:
+    generator(tuple(int, np.array)): Yields (size, polycube) for every polycube, smallest sizes first
+  
+    """
+    for level, polycubes in iter_levels(n, use_rle, workers, cache_dir):
+        for polycube in polycubes:
+            yield level, to_coords(polycube) if coords else polycube
+
+def to_coords(polycube):
+    """
+    Converts a polycube to the coordinates of its blocks.
+
+    Parameters:
+    polycube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
+
+    Returns:
+    np.array: (k, 3) int8 array with the x,y,z position of each of the k blocks, in np.nonzero order
+
+    """
+    return np.argwhere(polycube).astype(np.int8)
+
+def from_coords(coords):
+    """
+    Builds a polycube from the coordinates of its blocks.
+
+    Parameters:
+    coords (np.array): (k, 3) array or list of x,y,z block positions, in any frame of reference
+
+    Returns:
+    np.array: Cropped 3D Numpy byte array where 1 values indicate polycube positions
+
+    """
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 3)
+    coords = coords - coords.min(axis=0)
+    polycube = np.zeros(coords.max(axis=0) + 1, dtype=np.byte)
+    polycube[coords[:,0], coords[:,1], coords[:,2]] = 1
+    return polycube
+
+def expand_level(base_cubes, n, use_rle=False, workers=1):
+    """
+    Builds all polycubes of size n from all polycubes of size n-1.
+
+    Parameters:
+    base_cubes (list(np.array)): All polycubes of size n-1
+    n (int): The size of the polycubes being built, used for progress output
+    use_rle (bool): Deduplicate with the original run-length encoding instead of canonical keys
+    workers (int): Number of processes to split the base cubes across
+
+    Returns:
+    list(np.array): All polycubes of size n, in the order they were first found
+
+    """
+    # Empty list of new n-polycubes
+    polycubes = []
+    polycubes_rle = set()
+    polycubes_keys = set()
+
+    if workers > 1:
+        # Contiguous shards merged in order keep the first occurrence of each key, exactly as the serial loop does
+        shard_size = max(1, math.ceil(len(base_cubes) / (workers * 8)))
+        shards = [base_cubes[i:i + shard_size] for i in range(0, len(base_cubes), shard_size)]
+        with Pool(workers) as pool:
+            for idx, (shard_cubes, candidates, rotations) in enumerate(pool.imap(expand_shard, shards)):
+                found = len(polycubes)
+                for key, new_cube in shard_cubes.items():
+                    if key not in polycubes_keys:
+                        polycubes.append(new_cube)
+                        polycubes_keys.add(key)
+
+                metrics.count("candidates", candidates)
+                metrics.count("duplicates", candidates - (len(polycubes) - found))
+                metrics.count("rotations_checked", rotations)
+                metrics.gauge("progress", (idx + 1) / len(shards))
+                metrics.tick()
+                perc = round(((idx + 1) / len(shards)) * 100,2)
+                print(f"\rGenerating polycubes n={n}: {perc}%", end="")
+
+        print(f"\rGenerating polycubes n={n}: 100%   ")
+
+        return polycubes
+
+    for idx, base_cube in enumerate(base_cubes):
+        found = len(polycubes)
+        candidates = 0
+        rotations = 0
+        # Iterate over possible expansion positions
+        for new_cube in expand_cube(base_cube):
+            candidates += 1
+            if use_rle:
+                exists, checked = cube_exists_rle(new_cube, polycubes_rle, count=True)
+                rotations += checked
+                if not exists:
+                    polycubes.append(new_cube.copy())
+                    polycubes_rle.add(rle(new_cube))
+            else:
+                key, checked = canonical_key(new_cube, count=True)
+                rotations += checked
+                if key not in polycubes_keys:
+                    polycubes.append(new_cube.copy())
+                    polycubes_keys.add(key)
+
+        # Counted once per base cube, so instrumentation stays out of the inner loop
+        metrics.count("candidates", candidates)
+        metrics.count("duplicates", candidates - (len(polycubes) - found))
+        metrics.count("rotations_checked", rotations)
+
+        if (idx % 100 == 0):               
+            metrics.gauge("progress", idx / len(base_cubes))
+            metrics.tick()
+            perc = round((idx / len(base_cubes)) * 100,2)
+            print(f"\rGenerating polycubes n={n}: {perc}%", end="")
+
+    print(f"\rGenerating polycubes n={n}: 100%   ")
+
+    return polycubes
+
+def expand_shard(base_cubes):
+    """
+    Expands a shard of base cubes and deduplicates the children locally.
+
+    Used as the worker function for parallel generation. Children are keyed by canonical_key,
+    so shards from different workers can be merged by key afterwards.
+
+    Parameters:
+    base_cubes (list(np.array)): Polycubes of size n-1 to expand
+
+    Returns:
+    tuple(dict(bytes, np.array), int, int): Canonical key to polycube of size n, in the order they were first found,
+    then the number of candidates expanded and of rotations checked, for the parent process's metrics
+
+    """
+    polycubes = {}
+    candidates = 0
+    rotations = 0
+    for base_cube in base_cubes:
+        for new_cube in expand_cube(base_cube):
+            candidates += 1
+            key, checked = canonical_key(new_cube, count=True)
+            rotations += checked
+            if key not in polycubes:
+                polycubes[key] = new_cube.copy()
+    return polycubes, candidates, rotations
+
+def rle(polycube):
+    """
+    Computes a simple run-length encoding of a given polycube. This function allows cubes to be more quickly compared via hashing.
+  
+    Converts a {0,1} nd array into a tuple that encodes the same shape. The array is first flattened, and then the following algorithm is applied:
+
+    1) The first three values in tuple contain the x,y,z dimension sizes of the array
+    2) Each string of zeros of length n is replaced with a single value -n
+    3) Each string of ones of length m is replaced with a single value +m
+  
+    Parameters:
+    polycube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
+  
+    Returns:
+    tuple(int): Run length encoded polycube in the form (X, Y, Z, a, b, c, ...)
+
+    """
+    r = []
+    r.extend(polycube.shape)
+    current = None
+    val = 0
+    for x in polycube.flat:
+        if current is None:
+            current = x
+            val = 1
+            pass
+        elif current == x:
+            val += 1
+        elif current != x:
+            r.append(val if current == 1 else -val)
+            current = x
+            val = 1
+
+    r.append(val if current == 1 else -val)
+
+    return tuple(r)
+
+def cube_exists_rle(polycube, polycubes_rle, count=False):
+    """
+    Determines if a polycube has already been seen.
+  
+    Considers all possible rotations of a cube against the existing cubes stored in memory.
+    Returns True if the cube exists, or False if it is new.
+  
+    Parameters:
+    polycube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
+    count (bool): Also return the number of rotations checked, for callers that add it to their metrics
+  
+    Returns:
+    boolean: True if polycube is already present in the set of all cubes so far.
+    With count, a tuple of that and the number of rotations checked.
+  
+    """
+    checked = 0
+    for cube_rotation in all_rotations(polycube):
+        checked += 1
+        if rle(cube_rotation) in polycubes_rle:
+            return (True, checked) if count else True
+
+    return (False, checked) if count else False
+
+# The 24 rotations as (axis permutation, flipped axes) pairs. A rotation matrix is a signed permutation
+# with determinant +1, so even permutations take an even number of flips and odd permutations an odd number.
+# Flips are stored as index tuples, so applying one is a single slicing view.
+ROTATIONS = [(perm, tuple(slice(None, None, -1) if axis in flips else slice(None) for axis in range(3)))
+             for perm, parity in (((0,1,2), 0), ((1,2,0), 0), ((2,0,1), 0), ((0,2,1), 1), ((2,1,0), 1), ((1,0,2), 1))
+             for flips in ([(), (0,1), (0,2), (1,2)] if parity == 0 else [(0,), (1,), (2,), (0,1,2)])]
+
+def canonical_key(polycube, count=False):
+    """
+    Computes a rotation-invariant key for a polycube.
+
+    The key of one orientation is its x,y,z dimension sizes followed by its flattened voxel grid packed into bits,
+    so two orientations share a key exactly when they have the same shape and the same voxels set.
+    Returns the smallest key over all 24 rotations, so every rotation of the same polycube maps to the same key
+    and a seen-set of canonical keys needs a single lookup per candidate.
+    Keys are ordered by their dimensions first, so only the rotations with sorted dimensions can be the minimum.
+    Those are built with plain transposes and flips and packed together in one np.packbits call.
+
+    Parameters:
+    polycube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
+    count (bool): Also return the number of rotations compared, for callers that add it to their metrics
+
+    Returns:
+    bytes: The minimum key over all rotations of polycube, (X, Y, Z as big-endian uint16) + bitmask.
+    With count, a tuple of that and the number of rotations compared.
+
+    """
+    shape = polycube.shape
+    dims = tuple(sorted(shape))
+    candidates = []
+    for perm, flips in ROTATIONS:
+        if (shape[perm[0]], shape[perm[1]], shape[perm[2]]) != dims:
+            continue
+        candidates.append(polycube.transpose(perm)[flips])
+    packed = np.packbits(np.stack(candidates).reshape(len(candidates), -1), axis=1)
+    key = np.array(dims, dtype='>u2').tobytes() + min(row.tobytes() for row in packed)
+    return (key, len(candidates)) if count else key
+
+CACHE_VERSION = 1
+
+def cache_path(n, cache_dir):
+    """Path of the cache file holding all polycubes of size n"""
+    return os.path.join(cache_dir, f"polycubes_{n}.npz")
+
+def save_polycubes(polycubes, n, cache_dir):
+    """
+    Saves all polycubes of size n to the cache directory.
+
+    The file holds a small header (format version, n, count), the shape of every polycube as a (count, 3) array,
+    and the voxels of all polycubes flattened one after the other and packed into bits.
+    The file is written under a temporary name and moved into place, so parallel jobs sharing a cache never read a partial file.
+
+    Parameters:
+    polycubes (list(np.array)): All polycubes of size n as numpy byte arrays
+    n (int): The size of the polycubes
+    cache_dir (str): Directory to save the cache file in
+
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    shapes = np.array([cube.shape for cube in polycubes], dtype=np.uint16).reshape(-1, 3)
+    bits = np.packbits(np.concatenate([cube.ravel() for cube in polycubes])) if polycubes else np.zeros(0, dtype=np.uint8)
+
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f".polycubes_{n}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, version=CACHE_VERSION, n=n, count=len(polycubes), shapes=shapes, bits=bits)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, cache_path(n, cache_dir))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def load_polycubes(n, cache_dir):
+    """
+    Loads all polycubes of size n from the cache directory.
+
+    Parameters:
+    n (int): The size of the polycubes
+    cache_dir (str): Directory containing the cache files
+
+    Returns:
+    list(np.array): All polycubes of size n as numpy byte arrays, or None if the cache has no usable entry for n
+
+    """
+    path = cache_path(n, cache_dir)
+    if not os.path.exists(path):
+        return None
+
+    # A truncated or corrupt file, or one whose bits do not cover its shapes, is a miss like a missing one
+    try:
+        with np.load(path) as data:
+            if int(data["version"]) != CACHE_VERSION or int(data["n"]) != n:
+                return None
+            count = int(data["count"])
+            shapes = data["shapes"]
+            bits = data["bits"]
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        return None
+
+    if shapes.ndim != 2 or shapes.shape != (count, 3) or bits.ndim != 1:
+        return None
+    sizes = np.prod(shapes, axis=1, dtype=np.int64)
+    if len(bits) != -(-int(sizes.sum()) // 8):
+        return None
+    voxels = np.unpackbits(bits, count=int(sizes.sum())).astype(np.byte)
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+
+    return [voxels[offsets[i]:offsets[i + 1]].reshape(shapes[i]) for i in range(count)]
+
+# Catalog sprite colours: the visible top, +x and +y faces of a cube shaded as if lit from above, with dark outlines
+CATALOG_BACKGROUND = (255, 255, 255)
+CATALOG_FACES = ((255, 214, 93), (219, 179, 60), (181, 145, 33))
+CATALOG_EDGE = (0, 0, 0)
+
+def cube_sprite(unit):
+    """
+    Rasterizes one unit cube in 2:1 isometric projection, seen from +x, +y and +z.
+    A block at (x, y, z) is drawn with its sprite's top-left corner at ((x - y - 1) * unit, (x + y) * unit / 2 - z * unit),
+    so the sprites of neighbouring blocks line up exactly on the pixel grid.
+
+    Parameters:
+    unit (int): Even number of pixels from the centre to the left edge of the sprite, and the height of a vertical cube edge
+
+    Returns:
+    (np.array, np.array): (2 * unit, 2 * unit, 3) uint8 colours and (2 * unit, 2 * unit) boolean coverage of the sprite
+
+    """
+    half = unit / 2
+    # Faces as corners in sprite pixels, from the projection of the cube's corners
+    faces = [
+        [(unit, 0), (2 * unit, half), (unit, unit), (0, half)],
+        [(2 * unit, half), (2 * unit, unit + half), (unit, 2 * unit), (unit, unit)],
+        [(0, half), (unit, unit), (unit, 2 * unit), (0, unit + half)],
+    ]
+    centres = np.arange(2 * unit) + 0.5
+    x, y = np.meshgrid(centres, centres)
+    colours = np.zeros((2 * unit, 2 * unit, 3), dtype=np.uint8)
+    covered = np.zeros((2 * unit, 2 * unit), dtype=bool)
+    edge_width = max(0.6, unit / 16)
+
+    for corners, colour in zip(faces, CATALOG_FACES):
+        corners = np.array(corners, dtype=np.float64)
+        starts, ends = corners, np.roll(corners, -1, axis=0)
+        # Signed distance of every pixel centre to each side of the convex face. Inside is positive on every side
+        direction = ends - starts
+        length = np.linalg.norm(direction, axis=1)
+        distance = (direction[:, 0, None, None] * (y - starts[:, 1, None, None])
+                    - direction[:, 1, None, None] * (x - starts[:, 0, None, None])) / length[:, None, None]
+        inside = (distance >= -0.5).all(axis=0)
+        colours[inside] = colour
+        colours[inside & (distance.min(axis=0) < edge_width)] = CATALOG_EDGE
+        covered |= inside
+    return colours, covered
+
+def catalog_unit(polycubes, tile_size, margin=4):
+    """
+    Finds the largest sprite unit at which every polycube fits in a tile, so all tiles of a catalog share one scale.
+
+    Parameters:
+    polycubes (list(np.array)): Polycubes to fit
+    tile_size (int): Width and height of a tile in pixels
+    margin (int): Empty pixels kept around each shape
+
+    Raises:
+    ValueError: If there are no polycubes to fit
+
+    Returns:
+    int: Even sprite unit for cube_sprite, at least 2
+
+    """
+    if not len(polycubes):
+        raise ValueError("There are no polycubes to catalog")
+    units = float("inf")
+    for polycube in polycubes:
+        coords = to_coords(polycube).astype(np.int64)
+        across = np.ptp(coords[:, 0] - coords[:, 1]) + 2
+        down = np.ptp(coords[:, 0] + coords[:, 1]) / 2 + np.ptp(coords[:, 2]) + 2
+        units = min(units, (tile_size - 2 * margin) / max(across, down))
+    return max(2, int(units) // 2 * 2)
+
+def render_tile(polycube, tile_size, unit=None, sprite=None):
+    """
+    Draws one polycube centred in a square tile, by pasting a cube sprite for each block from back to front.
+    Also usable on its own as a thumbnail of a shape.
+
+    Parameters:
+    polycube (np.array): 3D Numpy byte array where 1 values indicate polycube positions
+    tile_size (int): Width and height of the tile in pixels
+    unit (int): Sprite unit (see cube_sprite). Defaults to the largest at which the polycube fits
+    sprite (tuple): Precomputed cube_sprite(unit), to reuse across tiles
+
+    Returns:
+    np.array: (tile_size, tile_size, 3) uint8 RGB image
+
+    """
+    unit = unit or catalog_unit([polycube], tile_size)
+    colours, covered = sprite or cube_sprite(unit)
+    tile = np.empty((tile_size, tile_size, 3), dtype=np.uint8)
+    tile[:] = CATALOG_BACKGROUND
+
+    coords = to_coords(polycube).astype(np.int64)
+    # Blocks with a larger x + y + z are nearer the viewer, so drawing in that order needs no depth buffer
+    coords = coords[np.argsort(coords.sum(axis=1), kind="stable")]
+    left = (coords[:, 0] - coords[:, 1] - 1) * unit
+    top = (coords[:, 0] + coords[:, 1]) * unit // 2 - coords[:, 2] * unit
+    left += (tile_size - (left.max() - left.min() + 2 * unit)) // 2 - left.min()
+    top += (tile_size - (top.max() - top.min() + 2 * unit)) // 2 - top.min()
+
+    size = 2 * unit
+    for x, y in zip(left.tolist(), top.tolist()):
+        # Clip the sprite to the tile, for shapes that are too big for the unit
+        x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + size, tile_size), min(y + size, tile_size)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        mask = covered[y0 - y:y1 - y, x0 - x:x1 - x]
+        tile[y0:y1, x0:x1][mask] = colours[y0 - y:y1 - y, x0 - x:x1 - x][mask]
+    return tile
+
+def render_sheet(task):
+    """
+    Draws one sheet of a catalog: a grid of tiles filled row by row. Runs in the worker pool of render_catalog.
+
+    Parameters:
+    task (tuple): (polycubes, tile_size, unit, columns, rows) for the sheet
+
+    Returns:
+    np.array: (rows * tile_size, columns * tile_size, 3) uint8 RGB image
+
+    """
+    polycubes, tile_size, unit, columns, rows = task
+    sprite = cube_sprite(unit)
+    sheet = np.empty((rows * tile_size, columns * tile_size, 3), dtype=np.uint8)
+    sheet[:] = CATALOG_BACKGROUND
+    for idx, polycube in enumerate(polycubes):
+        y, x = divmod(idx, columns)
+        sheet[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size] = render_tile(polycube, tile_size, unit, sprite)
+    # Grid lines between tiles
+    sheet[::tile_size] = 192
+    sheet[:, ::tile_size] = 192
+    return sheet
+
+def render_catalog(polycubes, path, tile_size=96, columns=16, rows=16, single=False, workers=1):
+    """
+    Renders a catalog of polycubes as contact sheets of fixed-size tiles, one shape per tile at a shared scale.
+    Sheets are drawn in parallel, and an index maps every shape to its sheet and tile.
+    Unlike render_shapes, the cost is linear in the number of shapes, so every level up to large n can be checked by eye.
+
+    Parameters:
+    polycubes (list(np.array)): Polycubes to draw, in order. Their position in the list is the shape number in the index
+    path (str): Output path without extension. Sheets are saved as path_0000.png, path_0001.png, ... and the index as path_index.csv
+    tile_size (int): Width and height of each tile in pixels
+    columns (int): Number of tiles across a sheet
+    rows (int): Number of tiles down a sheet
+    single (bool): Save every tile in one image, path.png, growing down as far as needed, instead of in sheets
+    workers (int): Number of processes drawing sheets
+
+    Returns:
+    list(str): Paths of the images written
+
+    """
+    unit = catalog_unit(polycubes, tile_size)
+    per_sheet = columns * rows
+    tasks = [(polycubes[start:start + per_sheet], tile_size, unit, columns, rows) for start in range(0, len(polycubes), per_sheet)]
+    if single:
+        # Draw in bands of rows so the work still splits across processes, and trim the last band to the rows it uses
+        used_rows = -(-len(polycubes) // columns)
+        file_names = [os.path.basename(path) + ".png"] * len(tasks)
+    else:
+        file_names = [f"{os.path.basename(path)}_{sheet:04d}.png" for sheet in range(len(tasks))]
+
+    with Pool(workers) as pool:
+        sheets = pool.imap(render_sheet, tasks)
+        if single:
+            image = np.concatenate(list(sheets))[:used_rows * tile_size]
+            plt.imsave(path + ".png", image)
+            paths = [path + ".png"]
+        else:
+            paths = []
+            for sheet, file_name in zip(sheets, file_names):
+                paths.append(os.path.join(os.path.dirname(path), file_name))
+                plt.imsave(paths[-1], sheet)
+
+    with open(path + "_index.csv", "w") as f:
+        f.write("shape,num_blocks,file,x,y,width,height\n")
+        for idx, polycube in enumerate(polycubes):
+            sheet, position = divmod(idx, per_sheet)
+            row, column = divmod(position, columns)
+            if single:
+                row += sheet * rows
+            f.write(f"{idx},{int(polycube.sum())},{file_names[sheet]},{column * tile_size},{row * tile_size},{tile_size},{tile_size}\n")
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                    prog='Polycube Generator',
+                    description='Generates all polycubes (combinations of cubes) of size n.')
+
+    parser.add_argument('n', metavar='N', type=int,
+                    help='The number of cubes within each polycube')
+    parser.add_argument('--rle', action='store_true',
+                    help='Deduplicate with the reference run-length encoding instead of canonical keys')
+    parser.add_argument('--check', action='store_true',
+                    help='Also run the reference run-length encoding and verify both find the same polycubes')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                    help='Number of processes to split the enumeration across')
+    parser.add_argument('-c', '--cache-dir', type=str, default=None,
+                    help='Directory to load and save generated polycubes of each size')
+    parser.add_argument('--metrics', type=str, default=None,
+                    help='Append progress and throughput metrics to this file as JSON lines')
+    parser.add_argument('--metrics-interval', type=float, default=5.0,
+                    help='Seconds between progress lines in the metrics file')
+    parser.add_argument('--profile', type=str, choices=["cprofile", "sample"], default=None,
+                    help='Also profile every phase (with --metrics)')
+    parser.add_argument('--catalog', type=str, default=None,
+                    help='Also draw the polycubes as contact sheets, saved as CATALOG_0000.png, ... with CATALOG_index.csv')
+    parser.add_argument('--tile-size', type=int, default=96,
+                    help='Width and height in pixels of each shape in the catalog')
+    parser.add_argument('--columns', type=int, default=16,
+                    help='Number of shapes across a catalog sheet')
+    parser.add_argument('--rows', type=int, default=16,
+                    help='Number of shapes down a catalog sheet')
+    parser.add_argument('--single-sheet', action='store_true',
+                    help='Save the catalog as one image, CATALOG.png, instead of sheets')
+    
+    args = parser.parse_args()
+   
+    n = args.n
+    if args.metrics:
+        metrics.configure(args.metrics, args.metrics_interval, args.profile)
+
+    # Start the timer
+    t1_start = perf_counter()
+
+    with metrics.phase("generate_polycubes", n=n):
+        all_cubes = list(generate_polycubes(n, use_rle=args.rle, workers=1 if args.rle else args.workers, cache_dir=args.cache_dir))
+
+    # Stop the timer
+    t1_stop = perf_counter()
+
+    print (f"Found {len(all_cubes)} unique polycubes")
+    print (f"Elapsed time: {round(t1_stop - t1_start,3)}s")
+
+    if args.check:
+        reference_cubes = generate_polycubes(n, use_rle=not args.rle, workers=args.workers if args.rle else 1)
+        keys = set(canonical_key(cube) for cube in all_cubes)
+        reference_keys = set(canonical_key(cube) for cube in reference_cubes)
+        if len(reference_cubes) == len(all_cubes) and keys == reference_keys:
+            print("Check passed: canonical keys and run-length encoding agree")
+        else:
+            print(f"Check FAILED: {len(all_cubes)} vs {len(reference_cubes)} polycubes")
+            sys.exit(1)
+
+    if args.catalog:
+        t2_start = perf_counter()
+        paths = render_catalog(all_cubes, args.catalog, args.tile_size, args.columns, args.rows, args.single_sheet, args.workers)
+        print(f"Drew {len(all_cubes)} polycubes on {len(paths)} images in {round(perf_counter() - t2_start,3)}s")
+
+
+# Code for if you want to generate pictures of the sets of cubes. Will work up to about n=8, before there are simply too many!
+# For larger cube sizes, render_catalog splits the dataset up into separate images.
+def render_shapes(shapes, path):
+    n = len(shapes)
+    dim = max(max(a.shape) for a in shapes)
+    i = math.isqrt(n) + 1
+    voxel_dim = dim * i
+    voxel_array = np.zeros((voxel_dim + i,voxel_dim + i,dim), dtype=np.byte)
+    pad = 1
+    for idx, shape in enumerate(shapes):
+        x = (idx % i) * dim + (idx % i)
+        y = (idx // i) * dim + (idx // i)
+        xpad = x * pad
+        ypad = y * pad
+        s = shape.shape
+        voxel_array[x:x + s[0], y:y + s[1] , 0 : s[2]] = shape
+
+    voxel_array = crop_cube(voxel_array)
+    colors = np.empty(voxel_array.shape, dtype=object)
+    colors[:] = '#FFD65DC0'
+
+    ax = plt.figure(figsize=(20,16), dpi=600).add_subplot(projection='3d')
+    ax.voxels(voxel_array, facecolors = colors, edgecolor='k', linewidth=0.1)
+    
+    ax.set_xlim([0, voxel_array.shape[0]])
+    ax.set_ylim([0, voxel_array.shape[1]])
+    ax.set_zlim([0, voxel_array.shape[2]])
+    plt.axis("off")
+    ax.set_box_aspect((1, 1, voxel_array.shape[2] / voxel_array.shape[0]))
+    plt.savefig(path + ".png", bbox_inches='tight', pad_inches = 0)
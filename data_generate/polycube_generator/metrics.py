@@ -0,0 +1,202 @@
+"""
+Counters, timers and gauges shared by polycube generation and the data-generate.py phases.
+
+Counting is always on and costs a dict update, so hot loops should count once per batch rather than once per item.
+Nothing is written until configure() is given a path. From then on, tick() writes a progress snapshot as one JSON line
+at most every interval seconds, and every phase() writes a line when it starts and a summary line when it ends.
+"""
+import cProfile
+import json
+import os
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak RSS is left out
+    resource = None
+
+counters = Counter()
+timers = Counter()
+gauges = {}
+
+_file = None
+_interval = 5.0
+_profile = None
+_profile_dir = "."
+_started = time.monotonic()
+_last_emit = 0.0
+_last_counters = Counter()
+_phases = []
+_profiled = 0
+
+def configure(path, interval=5.0, profile=None):
+    """
+    Start writing metrics as JSON lines to path
+
+    Parameters:
+    path (str): File to append JSON lines to
+    interval (float): Smallest number of seconds between progress snapshots
+    profile (str): Also profile every phase, with "cprofile" (stats saved next to the metrics file) or "sample" (stack sampling)
+    """
+    global _file, _interval, _profile, _profile_dir
+    close()
+    _file = open(path, "a")
+    _interval = interval
+    _profile = profile
+    _profile_dir = os.path.dirname(os.path.abspath(path))
+
+def close():
+    global _file
+    if _file is not None:
+        _file.close()
+        _file = None
+
+def enabled():
+    return _file is not None
+
+def count(name, value=1):
+    counters[name] += value
+
+def gauge(name, value):
+    gauges[name] = value
+
+@contextmanager
+def timer(name):
+    """Add the time spent inside the block to timers[name], in seconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timers[name] += time.perf_counter() - start
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its finished children, in MB"""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1 / 1024 / 1024 if sys.platform == "darwin" else 1 / 1024
+    return (round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1),
+            round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale, 1))
+
+def derived(values):
+    """Ratios that explain where generation time goes, computed from the counters present"""
+    result = {}
+    if values.get("candidates"):
+        result["duplicate_hit_rate"] = round(values.get("duplicates", 0) / values["candidates"], 4)
+        result["rotations_per_candidate"] = round(values.get("rotations_checked", 0) / values["candidates"], 3)
+    return result
+
+def emit(event, **fields):
+    """Write one JSON line with the current counters, timers and gauges"""
+    if _file is None:
+        return
+    rss, children_rss = peak_rss_mb()
+    record = {"event": event, "time": time.time(), "elapsed": round(time.monotonic() - _started, 3),
+              "phase": _phases[-1]["name"] if _phases else None}
+    record.update(fields)
+    record.update({"counters": dict(counters), "timers": {name: round(value, 4) for name, value in timers.items()},
+                   "gauges": dict(gauges), "derived": derived(counters),
+                   "peak_rss_mb": rss, "children_peak_rss_mb": children_rss})
+    _file.write(json.dumps(record) + "\n")
+    _file.flush()
+
+def tick():
+    """Write a progress snapshot if interval seconds have passed since the last one. Cheap enough to call per batch"""
+    global _last_emit, _last_counters
+    if _file is None:
+        return
+    now = time.monotonic()
+    if now - _last_emit < _interval:
+        return
+    seconds = now - _last_emit if _last_emit else now - _started
+    rates = {name: round((value - _last_counters[name]) / seconds, 2) for name, value in counters.items()}
+    fields = {"rates": rates}
+    if _phases and "progress" in gauges and gauges["progress"] > 0:
+        phase_seconds = now - _phases[-1]["start"]
+        fields["eta"] = round(phase_seconds * (1 - gauges["progress"]) / gauges["progress"], 1)
+    _last_emit, _last_counters = now, counters.copy()
+    emit("progress", **fields)
+
+class StackSampler:
+    """
+    Count the innermost frame of the main thread outside the standard library every interval seconds, from a background thread.
+    Waiting on a pool result is then counted against the line that waits, not inside threading.
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = Counter()
+        self.thread_id = threading.main_thread().ident
+        self.running = False
+        self.stdlib = sysconfig.get_paths()["stdlib"]
+
+    def run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            while (frame is not None and frame.f_back is not None
+                   and (frame.f_code.co_filename.startswith(self.stdlib) or frame.f_code.co_filename == __file__)):
+                frame = frame.f_back
+            if frame is not None:
+                self.samples[f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"] += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        return self.samples.most_common(20)
+
+@contextmanager
+def phase(name, **fields):
+    """
+    Time a phase of a run, writing a start line and a summary line with the counter and timer changes during it.
+    With profiling configured, the phase also runs under cProfile or the stack sampler.
+    Only one cProfile can run at a time, so phases nested in a profiled phase are covered by its profile.
+    """
+    global _profiled
+    if _file is None:
+        yield
+        return
+
+    nested = bool(_phases)
+    state = {"name": name, "start": time.monotonic(), "counters": counters.copy(), "timers": timers.copy()}
+    _phases.append(state)
+    gauges.pop("progress", None)
+    emit("phase_start", **fields)
+
+    profiler = sampler = None
+    if _profile == "cprofile" and not nested:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif _profile == "sample":
+        sampler = StackSampler()
+        sampler.start()
+    try:
+        yield
+    finally:
+        summary = dict(fields)
+        if profiler is not None:
+            profiler.disable()
+            _profiled += 1
+            path = os.path.join(_profile_dir, f"profile_{_profiled:03d}_{name}.prof")
+            profiler.dump_stats(path)
+            summary["profile"] = path
+        if sampler is not None:
+            summary["samples"] = sampler.stop()
+
+        changed = counters - state["counters"]
+        summary["seconds"] = round(time.monotonic() - state["start"], 3)
+        summary["phase_counters"] = dict(changed)
+        summary["phase_timers"] = {key: round(value, 4) for key, value in (timers - state["timers"]).items()}
+        summary["phase_derived"] = derived(changed)
+        emit("phase_end", **summary)
+        _phases.pop()
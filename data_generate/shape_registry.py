@@ -0,0 +1,33 @@
+import numpy as np
+import pair_table
+import shape_symmetry
+
+# Every polycube with a dense integer shape id, and the per-shape data that pairs, labels and renders look up by id.
+# Indexing, iterating and len() behave like the plain list of block coordinates it replaces.
+class ShapeRegistry:
+    def __init__(self, polycubes, num_cubes):
+        # Block positions of each shape as tuples of standard ints
+        self.coords = [[tuple(int(v) for v in block) for block in polycube] for polycube in polycubes]
+        self.num_cubes = num_cubes
+        self.num_blocks = np.array([len(coords) for coords in self.coords], dtype=np.uint8)
+
+        # Padded rows computed once: the binary shape table, and the CSV cells with "()" for missing blocks
+        self.table = pair_table.shape_table(self.coords, num_cubes)
+        self.csv_cells = pair_table.shape_csv_cells(self.table)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __getitem__(self, shape_id):
+        return self.coords[shape_id]
+
+    def __iter__(self):
+        return iter(self.coords)
+
+    # The ids compared to decide SAME. Generated polycubes are unique up to rotation, so this is the shape id itself
+    def label_ids(self):
+        return np.arange(len(self), dtype=np.uint32)
+
+    # For every shape and angle, the smallest angle id that gives a pixel-identical view because of the shape's symmetry
+    def view_aliases(self, angles):
+        return shape_symmetry.view_aliases(self.coords, angles)
@@ -0,0 +1,57 @@
+import os
+import sys
+import numpy as np
+from polycube_generator import cubes
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_render"))
+from software_render import rotation_matrices
+
+# The 24 lattice rotations from cubes.ROTATIONS as signed permutation matrices acting on (x, y, z) block positions.
+# Rotation (perm, flips) moves axis perm[i] to axis i, reversed when axis i is flipped.
+LATTICE_ROTATIONS = np.array([
+    [[(-1 if flips[i].step == -1 else 1) if j == perm[i] else 0 for j in range(3)] for i in range(3)]
+    for perm, flips in cubes.ROTATIONS
+], dtype=np.int64)
+
+# Indices into LATTICE_ROTATIONS of the rotations that map a shape onto itself.
+# Shapes are rendered centred on their bounding box, so positions are compared doubled and centred to stay integers.
+def symmetry_group(coords):
+    coords = np.array(coords, dtype=np.int64).reshape(-1, 3)
+    centred = 2 * coords - (coords.min(axis=0) + coords.max(axis=0))
+    blocks = set(map(tuple, centred.tolist()))
+    return tuple(index for index, rotation in enumerate(LATTICE_ROTATIONS)
+                 if set(map(tuple, (centred @ rotation.T).tolist())) == blocks)
+
+# Rounded rotation matrices as hashable keys, so rotations that only differ by float error compare equal
+def rotation_keys(rotations):
+    rounded = np.round(rotations, 6) + 0.0
+    return [row.tobytes() for row in rounded.reshape(len(rounded), -1)]
+
+# For one symmetry group, the representative angle id of every angle.
+# The view at angle a shows R_a @ shape, and R_a @ M @ shape is the same picture for every M in the group,
+# so every angle b on the grid with R_b = R_a @ M is an alias of a. The representative is the smallest such angle id.
+def group_aliases(group, rotations, angle_ids):
+    aliases = np.arange(len(rotations), dtype=np.uint16)
+    for index in group:
+        for angle, key in enumerate(rotation_keys(rotations @ LATTICE_ROTATIONS[index])):
+            other = angle_ids.get(key)
+            if other is not None and other < aliases[angle]:
+                aliases[angle] = other
+    return aliases
+
+# The alias table: for every shape and angle, the id of the smallest angle that renders a pixel-identical image.
+# Computed once per distinct symmetry group, since most shapes share the trivial one.
+def view_aliases(polycubes, angles):
+    rotations = rotation_matrices(angles)
+    angle_ids = {}
+    for angle, key in enumerate(rotation_keys(rotations)):
+        angle_ids.setdefault(key, angle)
+
+    by_group = {}
+    aliases = np.empty((len(polycubes), len(rotations)), dtype=np.uint16)
+    for shape_id, coords in enumerate(polycubes):
+        group = symmetry_group(coords)
+        if group not in by_group:
+            by_group[group] = group_aliases(group, rotations, angle_ids)
+        aliases[shape_id] = by_group[group]
+    return aliases
@@ -2,6 +2,7 @@ import pygame
 from pygame.locals import *
 from OpenGL.GL import *
 from OpenGL.GLU import *
+import gl_shape
 
 ### Defined values ###
 cube_positions = [
@@ -12,35 +13,6 @@ cube_positions = [
     (4,4,0),
 ]
 
-# Define a cube (8 vertices)
-vertices = [
-    [1, 1, -1],
-    [1, -1, -1],
-    [-1, -1, -1],
-    [-1, 1, -1],
-    [1, 1, 1],
-    [1, -1, 1],
-    [-1, -1, 1],
-    [-1, 1, 1]
-]
-
-edges = [
-    (0,1), (1,2), (2,3), (3,0),
-    (4,5), (5,6), (6,7), (7,4),
-    (0,4), (1,5), (2,6), (3,7)
-]
-
-def draw_cube(position=(0,0,0)):
-    """Draw a cube translated to the given position"""
-    glPushMatrix()
-    glTranslatef(*position)
-    glBegin(GL_LINES)
-    for edge in edges:
-        for vertex in edge:
-            glVertex3fv(vertices[vertex])
-    glEnd()
-    glPopMatrix()
-
 def render_shape(cubes, angle=(30,30)):
     """Render a shape made from cubes at a given angle, with mouse control"""
     pygame.init()
@@ -53,6 +25,9 @@ def render_shape(cubes, angle=(30,30)):
     clock = pygame.time.Clock()
     running = True
 
+    # Compiled once, then drawn with a single call every frame
+    shape = gl_shape.get_shape(tuple(cubes), cubes)
+
     rot_x, rot_y = angle
     dragging = False
     last_mouse_pos = None
@@ -84,8 +59,7 @@ def render_shape(cubes, angle=(30,30)):
         glRotatef(rot_y, 0, 1, 0)
 
         # Draw all cubes in the shape
-        for cube_pos in cubes:
-            draw_cube(cube_pos)
+        gl_shape.draw_shape_edges(shape)
 
         glPopMatrix()
         pygame.display.flip()
@@ -1 +1,39 @@
-# PLACEHOLDER
\ No newline at end of file
+import argparse
+import os
+import numpy as np
+import image_shards
+import image_store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the single images of a dataset once, into a store that pairs reference.")
+    parser.add_argument('--shapes', type=str, default="shapes.npy", help='Path to the shape table written by data-generate.py --format npy')
+    parser.add_argument('--angles', type=str, default="angles.npy", help='Path to the angle table written by data-generate.py --format npy')
+    parser.add_argument('--aliases', type=str, default="view_aliases.npy", help='Alias table of views that look identical because of symmetry. Only one image per alias is rendered. Ignored when the file does not exist')
+    parser.add_argument('--pairs', type=str, default=None, help='Pair table (paired_cubes.npy). Only the images it references are rendered. Renders every (shape, angle) image when not given')
+    parser.add_argument('--store', type=str, default="images", help='Directory of the image store. Images already in it are not rendered again')
+    parser.add_argument('-f', '--format', type=str, choices=["png", "shards"], default="png", help='Store one PNG per image, or append raw uint8 images to memory-mappable .npy shards with an index.npy of (shape_id, angle_id) to shard and offset')
+    parser.add_argument('--shard-size', type=int, default=4096, help='Number of images per shard (with --format shards)')
+    parser.add_argument('--references', type=str, default="pair_images.csv", help='Where to write the pairs as references into the PNG store (with --pairs)')
+    parser.add_argument('--size', type=int, nargs=2, default=[128, 128], help='Width and height of the images')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of rendering processes (default: all cores)')
+    args = parser.parse_args()
+
+    shapes = np.load(args.shapes)
+    angles = np.load(args.angles)
+    pairs = np.load(args.pairs, mmap_mode="r") if args.pairs else None
+    aliases = np.load(args.aliases) if os.path.exists(args.aliases) else None
+
+    if pairs is not None:
+        print("Finding referenced images...")
+        wanted = image_store.referenced_keys(pairs, len(shapes), len(angles), aliases)
+    else:
+        wanted = image_store.representative_views(len(shapes), len(angles), aliases)
+    if args.format == "shards":
+        image_shards.render_to_shards(args.store, shapes, angles, wanted, aliases, tuple(args.size), args.shard_size, args.workers)
+    else:
+        image_store.render_missing(args.store, shapes, angles, wanted, tuple(args.size), args.workers)
+
+    if pairs is not None and args.format == "png":
+        print("Writing pair references...")
+        image_store.write_references(pairs, args.references, aliases)
+    print("Done.")
@@ -0,0 +1,61 @@
+import ctypes
+import numpy as np
+from collections import namedtuple
+from OpenGL.GL import *
+import shape_geometry
+
+# A compiled shape on the GPU: one vertex buffer holding positions then normals,
+# and one index buffer holding the face quads then the edge lines
+GLShape = namedtuple("GLShape", ["vertex_buffer", "index_buffer", "normal_offset", "face_count", "edge_offset", "edge_count"])
+
+# Shapes already uploaded in the current context, by shape id. Reused across angles and frames.
+compiled_shapes = {}
+
+def upload_shape(buffers):
+    """Upload a shape_geometry.ShapeBuffers to vertex buffer objects in the current OpenGL context"""
+    vertex_data = np.concatenate([buffers.vertices, buffers.normals]).astype(np.float32)
+    index_data = np.concatenate([buffers.face_indices, buffers.edge_indices]).astype(np.uint32)
+
+    vertex_buffer, index_buffer = glGenBuffers(2)
+    glBindBuffer(GL_ARRAY_BUFFER, vertex_buffer)
+    glBufferData(GL_ARRAY_BUFFER, vertex_data.nbytes, vertex_data, GL_STATIC_DRAW)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, index_buffer)
+    glBufferData(GL_ELEMENT_ARRAY_BUFFER, index_data.nbytes, index_data, GL_STATIC_DRAW)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+
+    return GLShape(vertex_buffer, index_buffer, buffers.vertices.nbytes,
+                   len(buffers.face_indices), buffers.face_indices.nbytes, len(buffers.edge_indices))
+
+def get_shape(shape_id, centres):
+    """Compile and upload the shape with the given id the first time it is drawn, then reuse it"""
+    shape = compiled_shapes.get(shape_id)
+    if shape is None:
+        shape = compiled_shapes[shape_id] = upload_shape(shape_geometry.compile_shape(centres))
+    return shape
+
+def bind_shape(shape):
+    glBindBuffer(GL_ARRAY_BUFFER, shape.vertex_buffer)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, shape.index_buffer)
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glVertexPointer(3, GL_FLOAT, 0, None)
+    glEnableClientState(GL_NORMAL_ARRAY)
+    glNormalPointer(GL_FLOAT, 0, ctypes.c_void_p(shape.normal_offset))
+
+def unbind_shape():
+    glDisableClientState(GL_NORMAL_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+
+def draw_shape_faces(shape):
+    """Draw every exposed face of a shape with one draw call"""
+    bind_shape(shape)
+    glDrawElements(GL_QUADS, shape.face_count, GL_UNSIGNED_INT, None)
+    unbind_shape()
+
+def draw_shape_edges(shape):
+    """Draw every distinct edge of a shape with one draw call"""
+    bind_shape(shape)
+    glDrawElements(GL_LINES, shape.edge_count, GL_UNSIGNED_INT, ctypes.c_void_p(shape.edge_offset))
+    unbind_shape()
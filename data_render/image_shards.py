@@ -0,0 +1,162 @@
+import json
+import os
+import numpy as np
+from multiprocessing import Pool
+import image_store
+import software_render
+
+# Where each (shape_id, angle_id) image is stored. Both are -1 for images that have not been written yet.
+INDEX_DTYPE = np.dtype([("shard", "<i4"), ("offset", "<i4")])
+
+def shard_path(directory, shard):
+    return os.path.join(directory, f"images_{shard:05d}.npy")
+
+def index_path(directory):
+    return os.path.join(directory, "index.npy")
+
+def open_dataset(directory, shapes, angles, size, shard_size=4096):
+    """
+    Create a sharded image dataset in directory, or check that an existing one was rendered from the same shapes, angles and size.
+    A dataset rendered before the angle grid was refined is extended to the new angles, with no images for them yet.
+    Every shard is a (shard_size, height, width) uint8 .npy file, filled in order as images are appended.
+
+    Raises:
+    ValueError: If directory holds a dataset with different settings
+
+    Returns:
+    np.array: The (num_shapes, num_angles) index of the images written so far
+    """
+    os.makedirs(directory, exist_ok=True)
+    settings = dict(image_store.store_settings(shapes, angles, size), shard_size=shard_size)
+    path = os.path.join(directory, "dataset.json")
+    existing = None
+    if os.path.exists(path):
+        with open(path) as f:
+            existing = json.load(f)
+        if existing != settings and not image_store.extends_settings(existing, settings, angles):
+            raise ValueError(f"{directory} holds a dataset with different settings, use a new directory")
+
+    if existing != settings:
+        with open(path, "w") as f:
+            json.dump(settings, f, indent=2)
+
+    index = np.full((len(shapes), len(angles)), -1, dtype=INDEX_DTYPE)
+    if os.path.exists(index_path(directory)):
+        written = np.load(index_path(directory))
+        if written.shape == index.shape:
+            return written
+        index[:, :written.shape[1]] = written
+    save_index(directory, index)
+    return index
+
+def save_index(directory, index):
+    """Replace the index in one step. Images become visible to readers only once the index points at them"""
+    tmp_path = index_path(directory) + ".tmp.npy"
+    np.save(tmp_path, index)
+    os.replace(tmp_path, index_path(directory))
+
+def append_images(directory, index, shape_ids, angle_ids, images, shard_size):
+    """
+    Write images after the last one in the dataset, starting new shards as they fill up, then record them in the index.
+    Existing shards are only ever appended to, so readers can keep using their maps while new images are added.
+    """
+    written = index["shard"].astype(np.int64) * shard_size + index["offset"]
+    slot = int(written.max()) + 1 if (index["shard"] >= 0).any() else 0
+    slots = np.arange(slot, slot + len(images))
+
+    for shard in np.unique(slots // shard_size):
+        in_shard = slots // shard_size == shard
+        path = shard_path(directory, shard)
+        if os.path.exists(path):
+            data = np.load(path, mmap_mode="r+")
+        else:
+            data = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(shard_size,) + images.shape[1:])
+        data[slots[in_shard] % shard_size] = images[in_shard]
+        data.flush()
+        del data
+
+    index["shard"][shape_ids, angle_ids] = slots // shard_size
+    index["offset"][shape_ids, angle_ids] = slots % shard_size
+    save_index(directory, index)
+
+def render_shape_images(task):
+    """Render the given angles of one shape in one batch. Runs in the worker pool"""
+    shape_id, blocks, angle_ids, angles, size = task
+    return shape_id, angle_ids, software_render.render_views(blocks, angles, size)
+
+def render_to_shards(directory, shapes, angles, wanted, aliases=None, size=(128, 128), shard_size=4096, workers=None):
+    """
+    Render every wanted image that is not in the dataset yet and append it to the shards.
+    Rendering runs in a process pool, one task per shape, and this process appends the results in order of completion.
+    With an alias table, aliased views are pointed at their representative's image rather than stored again.
+
+    Returns:
+    int: Number of images rendered
+    """
+    index = open_dataset(directory, shapes, angles, size, shard_size)
+    missing = wanted & (index["shard"] < 0)
+    print(f"{int(wanted.sum() - missing.sum())} images already in the dataset, {int(missing.sum())} to render")
+
+    angles = np.asarray(angles).tolist()
+    tasks = []
+    for shape_id in np.flatnonzero(missing.any(axis=1)):
+        angle_ids = np.flatnonzero(missing[shape_id])
+        blocks = shapes[shape_id]["blocks"][:shapes[shape_id]["num_blocks"]].tolist()
+        tasks.append((int(shape_id), blocks, angle_ids, [angles[angle_id] for angle_id in angle_ids], size))
+
+    rendered = 0
+    if tasks:
+        with Pool(workers or os.cpu_count()) as pool:
+            for shape_id, angle_ids, images in pool.imap_unordered(render_shape_images, tasks):
+                append_images(directory, index, np.full(len(angle_ids), shape_id), angle_ids, images, shard_size)
+                rendered += len(angle_ids)
+                print(f"\rRendering images: {round(rendered / int(missing.sum()) * 100, 2)}%", end="")
+        print()
+
+    if aliases is not None:
+        shape_ids = np.arange(len(shapes))[:, None]
+        aliased = (index["shard"] < 0) & (index["shard"][shape_ids, aliases] >= 0)
+        if aliased.any():
+            index[aliased] = index[shape_ids, aliases][aliased]
+            save_index(directory, index)
+    return rendered
+
+class ShardedImages:
+    """
+    Read-only random access to a sharded image dataset. Shards are opened lazily with np.memmap,
+    so looking up an image reads it straight from the page cache with no copy or decoding.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = np.load(index_path(directory))
+        self.shards = {}
+
+    def __len__(self):
+        return int((self.index["shard"] >= 0).sum())
+
+    def __contains__(self, key):
+        return self.index[key]["shard"] >= 0
+
+    def shard(self, shard):
+        if shard not in self.shards:
+            self.shards[shard] = np.load(shard_path(self.directory, shard), mmap_mode="r")
+        return self.shards[shard]
+
+    def __getitem__(self, key):
+        """The (height, width) image of key = (shape_id, angle_id), as a view into its shard"""
+        shard, offset = self.index[key].tolist()
+        if shard < 0:
+            raise KeyError(f"No image for (shape_id, angle_id) = {key}")
+        return self.shard(shard)[offset]
+
+    def get_batch(self, shape_ids, angle_ids):
+        """Gather the images of many keys into one (N, height, width) array, one fancy-indexing read per shard"""
+        entries = self.index[np.asarray(shape_ids), np.asarray(angle_ids)]
+        if (entries["shard"] < 0).any():
+            raise KeyError("Batch contains images that have not been rendered")
+        image_shape = self.shard(0).shape[1:]
+        batch = np.empty((len(entries),) + image_shape, dtype=np.uint8)
+        for shard in np.unique(entries["shard"]):
+            rows = entries["shard"] == shard
+            batch[rows] = self.shard(int(shard))[entries["offset"][rows]]
+        return batch
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from multiprocessing import Pool
+import software_render
+
+# Bump when the store layout or rendering changes, so old stores are not mixed with new images
+STORE_VERSION = 1
+
+def image_name(shape_id, angle_id):
+    """Path of the single image for (shape_id, angle_id), relative to the store directory"""
+    return f"{shape_id:06d}/{angle_id:05d}.png"
+
+def store_settings(shapes, angles, size):
+    """Everything an image in the store depends on. A store only holds images rendered with the same settings"""
+    return {
+        "version": STORE_VERSION,
+        "shapes_sha256": hashlib.sha256(np.ascontiguousarray(shapes).tobytes()).hexdigest(),
+        "angles_sha256": angles_sha256(angles),
+        "num_shapes": len(shapes),
+        "num_angles": len(angles),
+        "size": list(size),
+        "renderer": "software_render",
+    }
+
+def angles_sha256(angles):
+    return hashlib.sha256(np.ascontiguousarray(angles, dtype=np.uint16).tobytes()).hexdigest()
+
+def extends_settings(existing, settings, angles):
+    """
+    True if existing settings only differ from settings by covering fewer angles, the first ones of angles.
+    Angle ids never change when the angle grid is refined (see data_generate/angle_registry.py), so a store or dataset
+    rendered before a refinement stays valid and only needs the images of the new angles
+    """
+    num_angles = existing.get("num_angles", 0)
+    return num_angles <= len(angles) and existing == dict(settings, num_angles=num_angles, angles_sha256=angles_sha256(np.asarray(angles)[:num_angles]))
+
+def open_store(store_dir, shapes, angles, size):
+    """
+    Create the image store in store_dir, or check that an existing one was rendered from the same shapes, angles and size.
+    A store rendered before the angle grid was refined is extended to the new angles
+
+    Raises:
+    ValueError: If store_dir holds a store with different settings
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    settings = store_settings(shapes, angles, size)
+    path = os.path.join(store_dir, "store.json")
+    existing = None
+    if os.path.exists(path):
+        with open(path) as f:
+            existing = json.load(f)
+        if existing != settings and not extends_settings(existing, settings, angles):
+            raise ValueError(f"{store_dir} holds images rendered with different settings, use a new store directory")
+    if existing != settings:
+        with open(path, "w") as f:
+            json.dump(settings, f, indent=2)
+
+def representative_views(num_shapes, num_angles, aliases=None):
+    """(num_shapes, num_angles) mask of the views that have to be rendered: every view, or only the representatives in the alias table"""
+    if aliases is None:
+        return np.ones((num_shapes, num_angles), dtype=bool)
+    return aliases == np.arange(num_angles)
+
+def referenced_keys(pairs, num_shapes, num_angles, aliases=None, chunk_size=1 << 22):
+    """
+    (num_shapes, num_angles) mask of the single images referenced by a pair table, read chunk_size pairs at a time.
+    With an alias table, views are replaced by their representative so identical images are only rendered once
+    """
+    wanted = np.zeros((num_shapes, num_angles), dtype=bool)
+    for chunk_start in range(0, len(pairs), chunk_size):
+        chunk = pairs[chunk_start:chunk_start + chunk_size]
+        for shape, angle in (("shape_a", "angle_a"), ("shape_b", "angle_b")):
+            angle_ids = chunk[angle] if aliases is None else aliases[chunk[shape], chunk[angle]]
+            wanted[chunk[shape], angle_ids] = True
+    return wanted
+
+def missing_keys(store_dir, wanted):
+    """The (shape_id, angle_id) keys in the wanted mask that have no image in the store yet"""
+    return [(shape_id, angle_id) for shape_id, angle_id in zip(*np.nonzero(wanted))
+            if not os.path.exists(os.path.join(store_dir, image_name(shape_id, angle_id)))]
+
+def save_image_atomic(image, path):
+    """Save a greyscale image under a temporary name and move it into place, so the store never holds partial images"""
+    # Imported here so the settings helpers, and image_shards with them, do not need pygame on training machines
+    import pygame
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_", suffix=".png")
+    os.close(fd)
+    try:
+        rgb = np.repeat(image[..., None], 3, axis=2)
+        pygame.image.save(pygame.image.frombuffer(rgb.tobytes(), (image.shape[1], image.shape[0]), "RGB"), tmp_path)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def render_shape_views(task):
+    """Render the missing angles of one shape in one batch and save them to the store. Runs in the worker pool"""
+    store_dir, shape_id, blocks, angle_ids, angles, size = task
+    os.makedirs(os.path.join(store_dir, f"{shape_id:06d}"), exist_ok=True)
+    images = software_render.render_views(blocks, angles, size)
+    for angle_id, image in zip(angle_ids, images):
+        save_image_atomic(image, os.path.join(store_dir, image_name(shape_id, angle_id)))
+    return len(angle_ids)
+
+def render_missing(store_dir, shapes, angles, wanted, size=(128, 128), workers=None):
+    """
+    Render every wanted single image that is not in the store yet, in parallel, one task per shape
+
+    Parameters:
+    store_dir (str): Directory of the image store
+    shapes (np.array): Shape table from pair_table.shape_table
+    angles (np.array): Angle table from pair_table.angle_table
+    wanted (np.array): (num_shapes, num_angles) mask of the images to render (see representative_views and referenced_keys)
+    size (tuple): Image width and height
+    workers (int): Number of rendering processes (default: all cores)
+
+    Returns:
+    int: Number of images rendered
+    """
+    open_store(store_dir, shapes, angles, size)
+    missing = missing_keys(store_dir, wanted)
+    print(f"{int(wanted.sum()) - len(missing)} images already in the store, {len(missing)} to render")
+    if not missing:
+        return 0
+
+    by_shape = {}
+    for shape_id, angle_id in missing:
+        by_shape.setdefault(int(shape_id), []).append(int(angle_id))
+    angles = np.asarray(angles).tolist()
+    tasks = [(store_dir, shape_id, shapes[shape_id]["blocks"][:shapes[shape_id]["num_blocks"]].tolist(),
+              angle_ids, [angles[angle_id] for angle_id in angle_ids], size)
+             for shape_id, angle_ids in by_shape.items()]
+
+    rendered = 0
+    with Pool(workers or os.cpu_count()) as pool:
+        for count in pool.imap_unordered(render_shape_views, tasks):
+            rendered += count
+            print(f"\rRendering images: {round(rendered / len(missing) * 100, 2)}%", end="")
+    print()
+    return rendered
+
+def write_references(pairs, csv_path, aliases=None, chunk_size=1 << 16):
+    """Write a pair table as references into the store: id, SAME and the store paths of both images, through the alias table when given"""
+    with open(csv_path, "w", newline='') as f:
+        f.write("id,SAME,im_1,im_2\r\n")
+        for chunk_start in range(0, len(pairs), chunk_size):
+            chunk = np.array(pairs[chunk_start:chunk_start + chunk_size])
+            if aliases is not None:
+                chunk["angle_a"] = aliases[chunk["shape_a"], chunk["angle_a"]]
+                chunk["angle_b"] = aliases[chunk["shape_b"], chunk["angle_b"]]
+            f.write("".join(
+                f"{pair_id},{bool(same)},{image_name(shape_a, angle_a)},{image_name(shape_b, angle_b)}\r\n"
+                for pair_id, shape_a, angle_a, shape_b, angle_b, same in chunk.tolist()
+            ))
@@ -0,0 +1,75 @@
+import numpy as np
+from collections import namedtuple
+
+# The 6 face directions of a cube, as (axis, sign)
+directions = [(axis, sign) for axis in range(3) for sign in (1, -1)]
+
+def cube_centres(blocks):
+    """Convert unit block positions to the centres of 2-unit cubes, centred on the origin (as cube-generate.py renders them)"""
+    blocks = np.array(blocks, dtype=np.int64).reshape(-1, 3) * 2
+    return blocks - (blocks.min(axis=0) + blocks.max(axis=0)) // 2
+
+def exposed_faces(blocks):
+    """
+    Find the cube faces on the outside of a shape, culling the internal faces shared by adjacent cubes
+
+    Returns (quads, normals): a (F, 4, 3) array with the corners of each face in order around the face,
+    and the (F, 3) outward normal of each face
+    """
+    return cube_faces(cube_centres(blocks))
+
+def cube_faces(centres):
+    """Like exposed_faces, but for the centres of 2-unit cubes as the renderers place them"""
+    centres = np.array(centres, dtype=np.float32).reshape(-1, 3)
+    positions = np.rint(centres).astype(np.int64)
+    occupied = set(map(tuple, positions.tolist()))
+
+    quads, normals = [], []
+    for axis, sign in directions:
+        u, v = [a for a in range(3) if a != axis]
+        normal = np.zeros(3, dtype=np.int64)
+        normal[axis] = sign
+        corners = np.zeros((4, 3), dtype=np.int64)
+        corners[:, axis] = sign
+        corners[:, u] = (-1, 1, 1, -1)
+        corners[:, v] = (-1, -1, 1, 1)
+        for centre, position in zip(centres, positions):
+            if tuple(position + 2 * normal) not in occupied:
+                quads.append(centre + corners)
+                normals.append(normal)
+
+    return np.array(quads, dtype=np.float32).reshape(-1, 4, 3), np.array(normals, dtype=np.float32).reshape(-1, 3)
+
+def face_edges(quads):
+    """The distinct edges of the given faces as a (E, 2, 3) array, so an edge shared by neighbouring faces is drawn once"""
+    segments = np.concatenate([np.stack([quads[:, i], quads[:, (i + 1) % 4]], axis=1) for i in range(4)])
+    # Put the endpoints of each edge in the same order, so that duplicates compare equal
+    ordered = np.array([sorted(edge) for edge in segments.tolist()], dtype=segments.dtype).reshape(-1, 2, 3)
+    return np.unique(ordered, axis=0)
+
+# A shape compiled for drawing: one merged vertex buffer with a normal per vertex,
+# the corners of the exposed faces as quads, and the distinct edges as lines, both indexing into the vertices
+ShapeBuffers = namedtuple("ShapeBuffers", ["vertices", "normals", "face_indices", "edge_indices"])
+
+def compile_shape(centres):
+    """
+    Compile a shape into merged vertex and index buffers, with internal faces culled and duplicate edges removed
+
+    Parameters:
+    centres (list(tuple)): Centres of the 2-unit cubes in the shape
+
+    Returns:
+    ShapeBuffers: float32 vertices and normals, and uint32 face (4 per quad) and edge (2 per line) indices
+    """
+    quads, normals = cube_faces(centres)
+    vertices = quads.reshape(-1, 3)
+    face_indices = np.arange(len(vertices), dtype=np.uint32)
+
+    # Edges reuse the face corners at the same position rather than adding vertices
+    first_index = {}
+    for index, vertex in enumerate(map(tuple, vertices.tolist())):
+        first_index.setdefault(vertex, index)
+    edges = face_edges(quads)
+    edge_indices = np.array([first_index[vertex] for vertex in map(tuple, edges.reshape(-1, 3).tolist())], dtype=np.uint32)
+
+    return ShapeBuffers(vertices, np.repeat(normals, 4, axis=0), face_indices, edge_indices)
@@ -0,0 +1,145 @@
+import numpy as np
+import shape_geometry
+
+# Camera and light matching the OpenGL renderer in cube-generate.py:
+# gluPerspective(45, ...) looking down -z from 20 units away, and one directional light
+FIELD_OF_VIEW = 45
+CAMERA_DISTANCE = 20
+LIGHT_DIRECTION = np.array([5, 10, 20], dtype=np.float32) / np.linalg.norm([5, 10, 20])
+
+# Grey levels: faces darker than edges, shaded by the light between ambient and fully lit
+BACKGROUND = 0
+FACE_AMBIENT = 23
+FACE_DIFFUSE = 77
+EDGE = 255
+EDGE_WIDTH = 0.75
+EDGE_DEPTH_TOLERANCE = 0.1
+
+def rotation_matrices(angles):
+    """
+    Build the rotation for every (angle_x, angle_y) pair in degrees as an (A, 3, 3) array.
+    Applies the y rotation first, then x, like glRotatef(angle_x, 1, 0, 0) followed by glRotatef(angle_y, 0, 1, 0)
+    """
+    angles = np.radians(np.asarray(angles, dtype=np.float64).reshape(-1, 2))
+    cos_x, sin_x = np.cos(angles[:, 0]), np.sin(angles[:, 0])
+    cos_y, sin_y = np.cos(angles[:, 1]), np.sin(angles[:, 1])
+    zero, one = np.zeros(len(angles)), np.ones(len(angles))
+
+    rotate_x = np.stack([one, zero, zero, zero, cos_x, -sin_x, zero, sin_x, cos_x], axis=1).reshape(-1, 3, 3)
+    rotate_y = np.stack([cos_y, zero, sin_y, zero, one, zero, -sin_y, zero, cos_y], axis=1).reshape(-1, 3, 3)
+    return rotate_x @ rotate_y
+
+def project(points, size):
+    """Project (..., 3) camera-space points to (..., 2) pixel coordinates, with y pointing down the image"""
+    focal = 1 / np.tan(np.radians(FIELD_OF_VIEW) / 2)
+    aspect = size[0] / size[1]
+    depth = CAMERA_DISTANCE - points[..., 2]
+    x = (focal / aspect * points[..., 0] / depth + 1) / 2 * size[0]
+    y = (1 - focal * points[..., 1] / depth) / 2 * size[1]
+    return np.stack([x, y], axis=-1)
+
+def tiles(lo, tile_size, size):
+    """
+    Pixel centres of a tile_size square at the given per-angle top-left corners, kept inside the image.
+    Returns (x index, y index, x centre, y centre), each an (A, tile_size, tile_size) array
+    """
+    lo = np.clip(np.floor(lo).astype(np.int64), 0, np.maximum(np.array(size) - tile_size, 0))
+    offsets = np.arange(tile_size)
+    x = lo[:, 0, None, None] + offsets[None, None, :]
+    y = lo[:, 1, None, None] + offsets[None, :, None]
+    x, y = np.broadcast_arrays(x, y)
+    return x, y, (x + 0.5).astype(np.float32), (y + 0.5).astype(np.float32)
+
+def render_views(blocks, angles, size=(128, 128)):
+    """
+    Render one shape from every angle at once, without OpenGL
+
+    All vertices are rotated for every angle in one batched matmul. Every face and edge is then rasterised
+    for all angles together, over a small tile around it in each view rather than the whole image.
+    Faces are depth tested and shaded by one fixed light, and visible edges are drawn on top in white.
+
+    Parameters:
+    blocks (list(tuple)): Unit block positions of the shape
+    angles (list(tuple)): (angle_x, angle_y) viewing angles in degrees
+    size (tuple): Image width and height
+
+    Returns:
+    np.array: (A, height, width) uint8 greyscale images, one per angle
+    """
+    quads, normals = shape_geometry.exposed_faces(blocks)
+    edges = shape_geometry.face_edges(quads)
+    rotations = rotation_matrices(angles).astype(np.float32)
+    num_angles = len(rotations)
+
+    # Rotate all face corners, normals and edge endpoints for every angle at once
+    quads_view = (quads.reshape(-1, 3) @ rotations.transpose(0, 2, 1)).reshape(num_angles, -1, 4, 3)
+    normals_view = normals @ rotations.transpose(0, 2, 1)
+    edges_view = (edges.reshape(-1, 3) @ rotations.transpose(0, 2, 1)).reshape(num_angles, -1, 2, 3)
+    quads_screen = project(quads_view, size)
+    edges_screen = project(edges_view, size)
+
+    # Every face and edge fits in a tile of this size in every view
+    face_tile = int(np.ceil((quads_screen.max(axis=2) - quads_screen.min(axis=2)).max())) + 2
+    edge_tile = int(np.ceil((edges_screen.max(axis=2) - edges_screen.min(axis=2)).max() + 2 * EDGE_WIDTH)) + 2
+
+    focal = 1 / np.tan(np.radians(FIELD_OF_VIEW) / 2)
+    camera = np.array([0, 0, CAMERA_DISTANCE], dtype=np.float32)
+    shade = FACE_AMBIENT + FACE_DIFFUSE * np.clip(normals_view @ LIGHT_DIRECTION, 0, None)
+    depth_buffer = np.full((num_angles, size[1], size[0]), np.inf, dtype=np.float32)
+    images = np.full((num_angles, size[1], size[0]), BACKGROUND, dtype=np.uint8)
+
+    for face in range(quads.shape[0]):
+        # Faces turned away from the camera are hidden by the rest of the closed surface
+        facing = np.flatnonzero(np.einsum("ad,ad->a", normals_view[:, face], camera - quads_view[:, face, 0]) > 0)
+        if len(facing) == 0:
+            continue
+        corners = quads_screen[facing, face]
+        x, y, px, py = tiles(corners.min(axis=1), face_tile, size)
+
+        # Inside the convex quad when on the same side of all four edges.
+        # Corner order is reversed on screen for some angles, so accept either winding
+        positive = negative = True
+        for i in range(4):
+            start, end = corners[:, i], corners[:, (i + 1) % 4]
+            side = ((end[:, 0] - start[:, 0])[:, None, None] * (py - start[:, 1, None, None])
+                    - (end[:, 1] - start[:, 1])[:, None, None] * (px - start[:, 0, None, None]))
+            positive = positive & (side >= 0)
+            negative = negative & (side <= 0)
+
+        # Distance along each pixel's camera ray to the face plane
+        normal = normals_view[facing, face]
+        plane = np.einsum("ad,ad->a", normal, quads_view[facing, face, 0] - camera)
+        ray_x = (px / size[0] * 2 - 1) * (size[0] / size[1]) / focal
+        ray_y = (1 - py / size[1] * 2) / focal
+        along = normal[:, 0, None, None] * ray_x + normal[:, 1, None, None] * ray_y - normal[:, 2, None, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            depth = plane[:, None, None] / along
+
+        views = np.broadcast_to(facing[:, None, None], x.shape)
+        nearer = (positive | negative) & (depth < depth_buffer[views, y, x])
+        depth_buffer[views[nearer], y[nearer], x[nearer]] = depth[nearer]
+        images[views[nearer], y[nearer], x[nearer]] = np.broadcast_to(shade[facing, face, None, None], x.shape)[nearer]
+
+    all_views = np.arange(num_angles)
+    for edge in range(edges.shape[0]):
+        start, end = edges_screen[:, edge, 0], edges_screen[:, edge, 1]
+        x, y, px, py = tiles(np.minimum(start, end) - EDGE_WIDTH - 0.5, edge_tile, size)
+        direction = end - start
+        length = np.maximum(np.einsum("ad,ad->a", direction, direction), 1e-9)
+
+        # Closest point on the edge to each pixel, as a fraction t along it
+        t = np.clip(((px - start[:, 0, None, None]) * direction[:, 0, None, None]
+                     + (py - start[:, 1, None, None]) * direction[:, 1, None, None]) / length[:, None, None], 0, 1)
+        dx = px - (start[:, 0, None, None] + t * direction[:, 0, None, None])
+        dy = py - (start[:, 1, None, None] + t * direction[:, 1, None, None])
+
+        # Depth along the edge (1/depth is linear on screen), compared against the faces in front of it
+        start_depth = CAMERA_DISTANCE - edges_view[:, edge, 0, 2]
+        end_depth = CAMERA_DISTANCE - edges_view[:, edge, 1, 2]
+        edge_depth = 1 / ((1 - t) / start_depth[:, None, None] + t / end_depth[:, None, None])
+
+        views = np.broadcast_to(all_views[:, None, None], x.shape)
+        visible = (dx * dx + dy * dy <= EDGE_WIDTH * EDGE_WIDTH) & (edge_depth <= depth_buffer[views, y, x] + EDGE_DEPTH_TOLERANCE)
+        images[views[visible], y[visible], x[visible]] = EDGE
+
+    return images
@@ -1 +1,44 @@
-# PLACEHOLDER
\ No newline at end of file
+import argparse
+import ast
+import importlib.util
+import os
+import pygame
+from inference import InferenceEngine
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def load_module(path, name):
+    """Import a Python file by path, for scripts with hyphens in their names and for model files"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# A model file defines encode(images) -> embeddings and pair_head(embeddings_a, embeddings_b) -> probabilities of SAME
+def load_model(path):
+    model = load_module(path, "model")
+    return model.encode, model.pair_head
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rotate a shape and have the model decide in real time whether it is the same as a target view.")
+    parser.add_argument('--model', type=str, required=True, help='Python file defining encode(images) and pair_head(embeddings_a, embeddings_b)')
+    parser.add_argument('--positions', type=str, required=True, help='Blocks of the shape to rotate, formatted as "[(x1,y1,z1), (x2,y2,z2), ...]"')
+    parser.add_argument('--target-positions', type=str, required=True, help='Blocks of the target shape, in the same format')
+    parser.add_argument('--target-angle', type=float, nargs=2, default=[30, 30], help='Viewing angle of the target: rot_x rot_y')
+    parser.add_argument('--angle-quantum', type=float, default=5, help='Views closer than this many degrees share a cached embedding')
+    parser.add_argument('--idle-time', type=float, default=0.1, help='Seconds a view has to stay still before the model is run')
+    args = parser.parse_args()
+
+    cube_generate = load_module(os.path.join(root, "cube-generate.py"), "cube_generate")
+    encoder, head = load_model(args.model)
+    engine = InferenceEngine(encoder, head, args.angle_quantum, idle_time=args.idle_time)
+    blocks = ast.literal_eval(args.positions)
+    target = ast.literal_eval(args.target_positions)
+
+    def on_frame(rot_x, rot_y):
+        prediction, current = engine.on_frame(blocks, (rot_x, rot_y), target, args.target_angle)
+        if prediction is not None:
+            answer = "SAME" if prediction >= 0.5 else "DIFFERENT"
+            pygame.display.set_caption(f"{answer} ({prediction:.2f}){'' if current else ' ...'}")
+
+    cube_generate.render_shape(cube_generate.shape_geometry.cube_centres(blocks), angle=(30, 30), on_frame=on_frame)
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import numpy as np
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_render"))
+import software_render
+
+class InferenceEngine:
+    """
+    Answer SAME/DIFFERENT for two views while the user rotates them, without running the model on every frame
+
+    The model is split into a per-image encoder and a cheap pair head. Encoder outputs are kept in an LRU cache keyed by
+    (shape, quantized angle), so returning to a view, or keeping one shape still while rotating the other, costs nothing.
+    A prediction is only recomputed once the quantized views differ from the last evaluated ones and have not changed
+    for idle_time seconds, so dragging the mouse never blocks the render loop.
+
+    Parameters:
+    encoder (callable): Maps (N, H, W) float32 images in [0, 1] to (N, D) embeddings
+    head (callable): Maps two (N, D) embedding arrays to (N,) probabilities that the pairs are the SAME shape
+    angle_quantum (float): Views closer than this many degrees share an embedding
+    cache_size (int): Number of embeddings kept
+    idle_time (float): Seconds a view has to stay still before it is evaluated
+    size (tuple): Width and height of the images given to the encoder
+    """
+    def __init__(self, encoder, head, angle_quantum=5, cache_size=4096, idle_time=0.1, size=(128, 128)):
+        self.encoder = encoder
+        self.head = head
+        self.angle_quantum = angle_quantum
+        self.cache_size = cache_size
+        self.idle_time = idle_time
+        self.size = size
+        self.cache = OrderedDict()
+        self.requested = None
+        self.changed_at = 0.0
+        self.evaluated = None
+        self.prediction = None
+
+    def view_key(self, blocks, angle):
+        """Cache key of a view: the shape's blocks and the angle rounded to angle_quantum degrees"""
+        quantized = tuple(int(round(a / self.angle_quantum)) * self.angle_quantum % 360 for a in angle[:2])
+        return tuple(map(tuple, blocks)), quantized
+
+    def embed(self, keys):
+        """Embeddings of the given view keys, encoding all the uncached ones in one batch"""
+        missing = [key for key in dict.fromkeys(keys) if key not in self.cache]
+        if missing:
+            images = np.concatenate([software_render.render_views(blocks, [angle], self.size) for blocks, angle in missing])
+            for key, embedding in zip(missing, self.encoder(images.astype(np.float32) / 255)):
+                self.cache[key] = embedding
+        for key in keys:
+            self.cache.move_to_end(key)
+        # Read before trimming, a request can need more embeddings than the cache keeps
+        embeddings = np.stack([self.cache[key] for key in keys])
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return embeddings
+
+    def evaluate(self, keys):
+        embeddings = self.embed(list(keys))
+        return float(self.head(embeddings[:1], embeddings[1:])[0])
+
+    def predict(self, blocks_a, angle_a, blocks_b, angle_b):
+        """Probability that two views show the same shape, evaluated now"""
+        return self.evaluate((self.view_key(blocks_a, angle_a), self.view_key(blocks_b, angle_b)))
+
+    def on_frame(self, blocks_a, angle_a, blocks_b, angle_b, now=None):
+        """
+        Call once per frame with the current views. Evaluates them only when they changed and then stayed idle.
+
+        Returns:
+        (float, bool): The latest prediction (None before the first one) and whether it is for the current views
+        """
+        now = time.monotonic() if now is None else now
+        keys = (self.view_key(blocks_a, angle_a), self.view_key(blocks_b, angle_b))
+        if keys != self.requested:
+            self.requested = keys
+            self.changed_at = now
+        if keys != self.evaluated and now - self.changed_at >= self.idle_time:
+            self.prediction = self.evaluate(keys)
+            self.evaluated = keys
+        return self.prediction, keys == self.evaluated
@@ -0,0 +1,157 @@
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_render"))
+from image_shards import ShardedImages
+from software_render import rotation_matrices
+
+# Confusion cells, indexed by 2 * label + prediction
+CELLS = ["true_negative", "false_positive", "false_negative", "true_positive"]
+
+def load_model(path):
+    """
+    Import a model file defining encode(images) -> (N, D) embeddings, and either pair_scores(embeddings_a, embeddings_b),
+    giving the (Na, Nb) matrix of SAME probabilities for every combination, or the element-wise pair_head(embeddings_a, embeddings_b)
+    """
+    spec = importlib.util.spec_from_file_location("model", path)
+    model = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(model)
+    return model
+
+def tile_scores(model, embeddings_a, embeddings_b, pairs_per_call=1 << 16):
+    """
+    SAME probabilities for every pair in a tile, with one matrix product when the model provides pair_scores.
+    pair_head gets one embedding per pair, so it is called on pairs_per_call pairs of a block of rows at a time
+    rather than on copies of the embeddings for the whole tile.
+    """
+    if hasattr(model, "pair_scores"):
+        return model.pair_scores(embeddings_a, embeddings_b)
+    scores = np.empty((len(embeddings_a), len(embeddings_b)), dtype=np.float64)
+    block_rows = max(1, pairs_per_call // max(1, len(embeddings_b)))
+    for start in range(0, len(embeddings_a), block_rows):
+        block = embeddings_a[start:start + block_rows]
+        rows = np.repeat(block, len(embeddings_b), axis=0)
+        columns = np.tile(embeddings_b, (len(block), 1))
+        scores[start:start + len(block)] = np.asarray(model.pair_head(rows, columns)).reshape(len(block), len(embeddings_b))
+    return scores
+
+def encode_singles(model, images, num_shapes, num_angles, batch_size=256):
+    """
+    Encode every single image once, in the order data-generate.py numbers them: single k is shape k % num_shapes at angle k // num_shapes.
+    Views that alias one image in the dataset index are encoded once and copied.
+    """
+    slots = (images.index["shard"].astype(np.int64) << 32) | images.index["offset"]
+    unique_slots, first, inverse = np.unique(slots.T.ravel(), return_index=True, return_inverse=True)
+    shape_ids, angle_ids = first % num_shapes, first // num_shapes
+
+    embeddings = None
+    for start in range(0, len(first), batch_size):
+        batch = images.get_batch(shape_ids[start:start + batch_size], angle_ids[start:start + batch_size])
+        encoded = np.asarray(model.encode(batch.astype(np.float32) / 255), dtype=np.float32)
+        if embeddings is None:
+            embeddings = np.empty((len(first), encoded.shape[1]), dtype=np.float32)
+        embeddings[start:start + batch_size] = encoded
+        print(f"\rEncoding images: {round(min(start + batch_size, len(first)) / len(first) * 100, 2)}%", end="")
+    print()
+    return embeddings[inverse]
+
+def angle_deltas(angles, num_bins):
+    """(A, A) bin of the rotation angle between every two viewing angles, in num_bins equal bins from 0 to 180 degrees"""
+    rotations = rotation_matrices(angles)
+    relative = np.einsum("aji,bjk->abik", rotations, rotations)
+    cos = np.clip((np.trace(relative, axis1=2, axis2=3) - 1) / 2, -1, 1)
+    degrees = np.degrees(np.arccos(cos))
+    return np.minimum((degrees / 180 * num_bins).astype(np.int64), num_bins - 1)
+
+def evaluate_all_pairs(model, embeddings, shapes, angles, label_ids, tile_size=2048, delta_bins=18, threshold=0.5):
+    """
+    Score every ordered pair of single images, tile_size x tile_size singles at a time, and count the outcomes
+
+    Each tile is scored with one call to the model, and its confusion counts are added to the histogram with one np.bincount,
+    so memory stays at a few tiles whatever the number of pairs.
+
+    Returns:
+    np.array: (max blocks + 1, max blocks + 1, delta_bins, 4) counts of each confusion cell (see CELLS),
+    by block count of the first shape, block count of the second shape, and angle delta bin
+    """
+    num_shapes, num_angles = len(shapes), len(angles)
+    num_singles = num_shapes * num_angles
+    num_blocks = shapes["num_blocks"].astype(np.int64)
+    max_blocks = int(num_blocks.max()) + 1
+    deltas = angle_deltas(angles, delta_bins)
+
+    # Per-single lookups, in single order
+    single_shape = np.arange(num_singles) % num_shapes
+    single_angle = np.arange(num_singles) // num_shapes
+    single_blocks = num_blocks[single_shape]
+    single_label = np.asarray(label_ids)[single_shape]
+
+    counts = np.zeros(max_blocks * max_blocks * delta_bins * 4, dtype=np.int64)
+    num_tiles = (-(-num_singles // tile_size)) ** 2
+    done = 0
+    for i in range(0, num_singles, tile_size):
+        rows = slice(i, i + tile_size)
+        for j in range(0, num_singles, tile_size):
+            columns = slice(j, j + tile_size)
+            predicted = tile_scores(model, embeddings[rows], embeddings[columns]) >= threshold
+            same = single_label[rows, None] == single_label[None, columns]
+            cell = (((single_blocks[rows, None] * max_blocks + single_blocks[None, columns]) * delta_bins
+                     + deltas[single_angle[rows, None], single_angle[None, columns]]) * 4
+                    + 2 * same + predicted)
+            counts += np.bincount(cell.ravel(), minlength=len(counts))
+            done += 1
+            print(f"\rScoring pairs: {round(done / num_tiles * 100, 2)}%", end="")
+    print()
+    return counts.reshape(max_blocks, max_blocks, delta_bins, 4)
+
+def summarize(counts):
+    """Accuracy and confusion counts overall, by block count of the first shape, and by angle delta bin"""
+    def cells(values):
+        total = int(values.sum())
+        summary = {name: int(value) for name, value in zip(CELLS, values)}
+        summary["pairs"] = total
+        summary["accuracy"] = (int(values[0]) + int(values[3])) / total if total else None
+        return summary
+
+    by_blocks = counts.sum(axis=(1, 2))
+    by_delta = counts.sum(axis=(0, 1))
+    delta_width = 180 / counts.shape[2]
+    return {
+        "overall": cells(counts.sum(axis=(0, 1, 2))),
+        "by_blocks": {str(blocks): cells(values) for blocks, values in enumerate(by_blocks) if values.sum()},
+        "by_angle_delta": {f"{round(index * delta_width)}-{round((index + 1) * delta_width)}": cells(values)
+                           for index, values in enumerate(by_delta) if values.sum()},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure a model's accuracy on every pair of single images, by block count and angle delta.")
+    parser.add_argument('model', type=str, help='Python file defining encode(images), and pair_scores(embeddings_a, embeddings_b) or pair_head(embeddings_a, embeddings_b)')
+    parser.add_argument('images', type=str, help='Sharded image dataset holding every (shape, angle) image (data-render.py --format shards)')
+    parser.add_argument('--shapes', type=str, default="shapes.npy", help='Shape table written by data-generate.py --format npy')
+    parser.add_argument('--angles', type=str, default="angles.npy", help='Angle table written by data-generate.py --format npy')
+    parser.add_argument('--tile-size', type=int, default=2048, help='Number of single images per side of a scored tile')
+    parser.add_argument('--delta-bins', type=int, default=18, help='Number of angle delta bins between 0 and 180 degrees')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Predict SAME when the score is at least this')
+    parser.add_argument('-o', '--output', type=str, default="evaluation.json", help='Where to write the summary. The full histogram is saved next to it as .npy')
+    args = parser.parse_args()
+
+    shapes = np.load(args.shapes)
+    angles = np.load(args.angles)
+    model = load_model(args.model)
+    label_ids = np.arange(len(shapes))
+
+    start = time.perf_counter()
+    embeddings = encode_singles(model, ShardedImages(args.images), len(shapes), len(angles))
+    counts = evaluate_all_pairs(model, embeddings, shapes, angles, label_ids, args.tile_size, args.delta_bins, args.threshold)
+    summary = summarize(counts)
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+
+    np.save(os.path.splitext(args.output)[0] + ".npy", counts)
+    with open(args.output, "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"Accuracy over {summary['overall']['pairs']} pairs: {summary['overall']['accuracy']:.4f} ({summary['seconds']}s)")
@@ -0,0 +1,195 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_render"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_generate"))
+from image_shards import ShardedImages
+from pair_index import PairIndex, PairPermutation
+
+# Per-process image dataset for load_batch, opened once by init_worker so batches only carry their pair records
+_images = None
+
+def init_worker(images_dir):
+    global _images
+    _images = ShardedImages(images_dir)
+
+def augment(batch, rng, max_shift):
+    """
+    Augment a (B, 2, H, W) uint8 batch, with every step vectorized over the batch:
+    swap the two images of a pair, mirror both images of a pair together (mirroring only one would change
+    a SAME pair into the mirror-image shape), and shift each image by up to max_shift pixels.
+    Returns the augmented batch and a (B, 2) brightness scale for each image, applied by to_float
+    """
+    size, _, height, width = batch.shape
+    swap = rng.random(size) < 0.5
+    batch[swap] = batch[swap][:, ::-1]
+    mirror = rng.random(size) < 0.5
+    batch[mirror] = batch[mirror][..., ::-1]
+
+    if max_shift > 0:
+        # Every shifted window of a zero-padded copy is a view, so picking one per image copies each image once
+        padded = np.pad(batch, ((0, 0), (0, 0), (max_shift, max_shift), (max_shift, max_shift)))
+        windows = np.lib.stride_tricks.sliding_window_view(padded, (height, width), axis=(2, 3))
+        shift_y, shift_x = rng.integers(0, 2 * max_shift + 1, (2, size, 2))
+        batch = windows[np.arange(size)[:, None], np.arange(2)[None, :], shift_y, shift_x]
+
+    return batch, rng.uniform(0.8, 1.2, (size, 2)).astype(np.float32)
+
+def load_batch(job):
+    """
+    Gather both images of every pair in a batch from the dataset and augment them. Runs in the worker pool.
+    Images stay uint8 here, so a quarter of the bytes of a float batch go back to the trainer process
+    """
+    records, seed, max_shift = job
+    first = _images.get_batch(records["shape_a"], records["angle_a"])
+    second = _images.get_batch(records["shape_b"], records["angle_b"])
+    batch, brightness = np.stack([first, second], axis=1), None
+    if seed is not None:
+        batch, brightness = augment(batch, np.random.default_rng(seed), max_shift)
+    return batch, brightness, records["same"].astype(np.float32)
+
+def to_float(batch, brightness):
+    """Convert a uint8 batch to float32 in [0, 1], scaling the brightness of each image when given"""
+    scale = np.full(batch.shape[:2], 1 / 255, dtype=np.float32) if brightness is None else brightness / 255
+    images = np.multiply(batch, scale[..., None, None], dtype=np.float32)
+    return images if brightness is None else np.clip(images, 0, 1, out=images)
+
+class PairLoader:
+    """
+    Stream training batches from a pair table (paired_cubes.npy) and a sharded image dataset (data-render.py --format shards)
+
+    With shuffle="buffer", pair records are read from the memory-mapped table chunk by chunk in a random order, and
+    shuffled within a buffer of at most shuffle_buffer records, so the dataset is never loaded into RAM.
+    With shuffle="permutation", every epoch follows a PairPermutation of the whole table, a true shuffle that is computed
+    rather than stored, so set_position can resume an epoch at any batch in O(1).
+    Each batch is assembled by a worker pool from memory-mapped shards, prefetch batches ahead of the trainer.
+
+    Parameters:
+    pairs_path (str): Pair table written by data-generate.py --format npy, or a PairIndex to stream every pair without a table
+    images_dir (str): Sharded image dataset holding every image the pairs reference
+    batch_size (int): Number of pairs per batch
+    shuffle_buffer (int): Number of pair records shuffled together (with shuffle="buffer")
+    chunk_size (int): Number of pair records read from the table at a time
+    prefetch (int): Number of batches being assembled ahead of the trainer
+    workers (int): Number of loading processes (default: one per core left over by the trainer). 0 loads batches in this process
+    augment (bool): Apply random augmentations to every batch
+    max_shift (int): Largest shift of an image in pixels when augmenting
+    seed (int): Random seed. The same seed and epoch always give the same batches
+    shuffle (str): "buffer" or "permutation"
+    """
+    def __init__(self, pairs_path, images_dir, batch_size=64, shuffle_buffer=1 << 16, chunk_size=1 << 14,
+                 prefetch=8, workers=None, augment=True, max_shift=4, seed=0, shuffle="buffer"):
+        self.pairs = np.load(pairs_path, mmap_mode="r") if isinstance(pairs_path, str) else pairs_path
+        self.images_dir = images_dir
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+        self.workers = os.cpu_count() - 1 if workers is None else workers
+        self.augment = augment
+        self.max_shift = max_shift
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0
+        self.pool = None
+
+    def __len__(self):
+        return -(-len(self.pairs) // self.batch_size)
+
+    def set_position(self, epoch, batch=0):
+        """Make the next iteration resume epoch at the given batch, giving the same batches as an uninterrupted epoch"""
+        self.epoch = epoch
+        self.start_batch = batch
+
+    def shuffled_records(self, rng):
+        """Yield batches of pair records for one epoch, shuffled within a bounded buffer"""
+        buffer = self.pairs[:0].copy()
+        starts = rng.permutation(np.arange(0, len(self.pairs), self.chunk_size))
+        for position, start in enumerate(starts):
+            buffer = np.concatenate([buffer, self.pairs[start:start + self.chunk_size]])
+            rng.shuffle(buffer)
+            # Keep a full buffer back to mix with later chunks, and only empty it after the last chunk
+            if position == len(starts) - 1:
+                ready = len(buffer)
+            else:
+                ready = max(len(buffer) - self.shuffle_buffer, 0) // self.batch_size * self.batch_size
+            for batch_start in range(0, ready, self.batch_size):
+                yield buffer[batch_start:batch_start + self.batch_size]
+            buffer = buffer[ready:]
+
+    def permuted_jobs(self, epoch, start_batch):
+        """Yield load_batch jobs for one epoch in the order of its PairPermutation, from start_batch onwards"""
+        permutation = PairPermutation(len(self.pairs), self.seed, epoch)
+        for batch in range(start_batch, len(self)):
+            positions = permutation[batch * self.batch_size:(batch + 1) * self.batch_size]
+            # Each batch's augmentation seed depends only on its position, so resuming needs no earlier state
+            seed = int(np.random.SeedSequence((self.seed, epoch, batch)).generate_state(1, dtype=np.uint64)[0]) if self.augment else None
+            yield self.pairs[np.sort(positions)], seed, self.max_shift
+
+    def __iter__(self):
+        """Yield (images, labels) for one epoch: (B, 2, H, W) float32 images in [0, 1], and (B,) float32 SAME labels"""
+        epoch, start_batch = self.epoch, self.start_batch
+        self.epoch, self.start_batch = epoch + 1, 0
+        if self.shuffle == "permutation":
+            jobs = self.permuted_jobs(epoch, start_batch)
+        else:
+            # The buffer shuffle is sequential, so resuming replays the skipped batches' records without loading their images
+            rng = np.random.default_rng((self.seed, epoch))
+            jobs = islice(((records, int(rng.integers(1 << 62)) if self.augment else None, self.max_shift)
+                           for records in self.shuffled_records(rng)), start_batch, None)
+
+        if self.workers == 0:
+            init_worker(self.images_dir)
+            for job in jobs:
+                batch, brightness, labels = load_batch(job)
+                yield to_float(batch, brightness), labels
+            return
+
+        if self.pool is None:
+            self.pool = Pool(self.workers, initializer=init_worker, initargs=(self.images_dir,))
+        pending = deque()
+        for job in jobs:
+            pending.append(self.pool.apply_async(load_batch, (job,)))
+            if len(pending) >= self.prefetch:
+                batch, brightness, labels = pending.popleft().get()
+                yield to_float(batch, brightness), labels
+        while pending:
+            batch, brightness, labels = pending.popleft().get()
+            yield to_float(batch, brightness), labels
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream one epoch of training batches and report the loading throughput.")
+    parser.add_argument('pairs', type=str, help='Pair table written by data-generate.py --format npy, or the directory of its shapes.npy and angles.npy to stream every pair without a table')
+    parser.add_argument('images', type=str, help='Sharded image dataset written by data-render.py --format shards')
+    parser.add_argument('-b', '--batch-size', type=int, default=64, help='Number of pairs per batch')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of loading processes (default: one per core left over by the trainer)')
+    parser.add_argument('--shuffle', type=str, choices=["buffer", "permutation"], default="buffer", help='Shuffle within a bounded buffer, or follow a computed permutation of every pair')
+    parser.add_argument('--start-batch', type=int, default=0, help='Resume the epoch at this batch')
+    parser.add_argument('--no-augment', action='store_true', help='Do not augment the batches')
+    args = parser.parse_args()
+
+    pairs = args.pairs
+    if os.path.isdir(pairs):
+        pairs = PairIndex.load(os.path.join(pairs, "shapes.npy"), os.path.join(pairs, "angles.npy"), os.path.join(pairs, "angle_registry.json"))
+    loader = PairLoader(pairs, args.images, args.batch_size, workers=args.workers, augment=not args.no_augment, shuffle=args.shuffle)
+    loader.set_position(0, args.start_batch)
+    start = time.perf_counter()
+    count = 0
+    for images, labels in loader:
+        count += len(labels)
+    loader.close()
+    elapsed = time.perf_counter() - start
+    print(f"{count} pairs in {elapsed:.2f}s, {count / elapsed:.0f} pairs/s")